@@ -8,10 +8,132 @@ import sys
 import os
 import time
 import random
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import selectors
+from collections import deque
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from client.dns_client import DNSClient
+from client.dns_client import DNSClient, STATUS_IP
+from dns_protocol import DNSMessage, pop_message
+
+PERCENTILES = (50, 95, 99, 99.9)
+NS_PER_MS = 1_000_000
+
+
+def latency_percentiles(samples, percents=PERCENTILES):
+    """Compute several latency percentiles with a single sort.
+
+    Args:
+        samples: Sequence of latency samples (list or array.array).
+        percents: Percentiles to report, each in [0, 100].
+
+    Returns:
+        Dictionary mapping each percentile to its nearest-rank sample.
+    """
+    ordered = sorted(samples)
+    last = len(ordered) - 1
+    return {p: ordered[min(int(len(ordered) * p / 100), last)] for p in percents}
+
+
+def zipf_choices(domains, k, s=1.0):
+    """Draw k domains with Zipf-distributed popularity.
+
+    Real resolver traffic is heavy-tailed: a few names account for most
+    queries. The domain at popularity rank r is drawn with probability
+    proportional to 1 / r**s; ranks are assigned by shuffling a copy of
+    domains so popularity does not follow file order.
+
+    Args:
+        domains: Candidate domain names.
+        k: Number of draws.
+        s: Zipf exponent; larger values concentrate traffic on fewer names.
+
+    Returns:
+        List of k domain names.
+    """
+    ranked = random.sample(domains, len(domains))
+    weights = [1.0 / rank ** s for rank in range(1, len(ranked) + 1)]
+    return random.choices(ranked, weights, k=k)
+
+
+# Names accepted by choose_domains
+DISTRIBUTIONS = ('round-robin', 'uniform', 'zipf')
+
+
+def choose_domains(domains, k, distribution='uniform'):
+    """Pick k domains using the named distribution.
+
+    'round-robin' cycles through domains in order and is reproducible run
+    to run; 'uniform' and 'zipf' draw at random.
+    """
+    if distribution == 'round-robin':
+        return [domains[i % len(domains)] for i in range(k)]
+    if distribution == 'zipf':
+        return zipf_choices(domains, k)
+    return random.choices(domains, k=k)
+
+
+class LatencyHistogram:
+    """Fixed-size log-linear histogram of non-negative integer samples.
+
+    Values below 128 get exact buckets. Above that, every power-of-two
+    range is split into 64 linear sub-buckets (the HdrHistogram layout), so
+    a reported value is within 1/128 (~0.8%) of the recorded one while
+    memory stays constant no matter how many samples are recorded.
+
+    Attributes:
+        counts: Sample count per bucket.
+        total_count: Number of recorded samples.
+        total: Sum of recorded samples, for the mean.
+        min_value: Smallest recorded sample, or None if empty.
+        max_value: Largest recorded sample, or None if empty.
+    """
+
+    _EXACT = 128
+    _SUB_BUCKETS = 64
+
+    def __init__(self):
+        self.counts = [0] * (self._EXACT + 56 * self._SUB_BUCKETS)
+        self.total_count = 0
+        self.total = 0
+        self.min_value = None
+        self.max_value = None
+
+    def record_value(self, value):
+        """Add one sample."""
+        if value < self._EXACT:
+            index = max(value, 0)
+        else:
+            shift = value.bit_length() - 7
+            index = self._EXACT + (shift - 1) * self._SUB_BUCKETS + (value >> shift) - self._SUB_BUCKETS
+        self.counts[index] += 1
+        self.total_count += 1
+        self.total += value
+        if self.min_value is None or value < self.min_value:
+            self.min_value = value
+        if self.max_value is None or value > self.max_value:
+            self.max_value = value
+
+    def _bucket_value(self, index):
+        """Return the midpoint of the value range covered by a bucket."""
+        if index < self._EXACT:
+            return index
+        offset = index - self._EXACT
+        shift = offset // self._SUB_BUCKETS + 1
+        low = (offset % self._SUB_BUCKETS + self._SUB_BUCKETS) << shift
+        return low + (1 << (shift - 1))
+
+    def get_value_at_percentile(self, percent):
+        """Return the nearest-rank sample at percent (0-100), or None if empty."""
+        if not self.total_count:
+            return None
+        rank = max(1, min(self.total_count, int(self.total_count * percent / 100) + 1))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                value = self._bucket_value(index)
+                return min(max(value, self.min_value), self.max_value)
+        return self.max_value
 
 
 class DNSBenchmark:
@@ -29,7 +151,7 @@ class DNSBenchmark:
             'successful_queries': 0,
             'failed_queries': 0,
             'total_time': 0.0,
-            'query_times': [],
+            'query_times': LatencyHistogram(),
         }
 
     def load_test_domains(self, filename='data/dns_records.txt'):
@@ -60,33 +182,36 @@ class DNSBenchmark:
             domain: Domain name to resolve.
 
         Returns:
-            Dictionary with domain, result, time_ms, and success status.
+            Dictionary with domain, result, time_ns, and success status.
         """
-        start = time.time()
-        result = self.client.resolve(domain)
-        elapsed = (time.time() - start) * 1000
+        start = time.perf_counter_ns()
+        status, result = self.client.resolve(domain)
+        elapsed = time.perf_counter_ns() - start
 
-        success = not result.startswith('ERROR')
+        success = status == STATUS_IP
 
         return {
             'domain': domain,
             'result': result,
-            'time_ms': elapsed,
+            'time_ns': elapsed,
             'success': success
         }
 
-    def sequential_benchmark(self, domains, num_queries):
-        """Run sequential queries."""
-        print(f"\n=== Sequential Benchmark ({num_queries} queries) ===")
+    def sequential_benchmark(self, domains, num_queries, distribution='uniform'):
+        """Run sequential queries drawn from the given domain distribution."""
+        print(f"\n=== Sequential Benchmark ({num_queries} queries, {distribution}) ===")
+
+        picks = choose_domains(domains, num_queries, distribution)
+        times = self.results['query_times']
 
-        start_time = time.time()
+        start_time = time.perf_counter()
 
-        for i in range(num_queries):
-            domain = random.choice(domains)
+        for i, domain in enumerate(picks):
             result = self.single_query(domain)
 
             self.results['total_queries'] += 1
-            self.results['query_times'].append(result['time_ms'])
+            if result['time_ns'] is not None:
+                times.record_value(result['time_ns'])
 
             if result['success']:
                 self.results['successful_queries'] += 1
@@ -96,41 +221,167 @@ class DNSBenchmark:
             if (i + 1) % 100 == 0:
                 print(f"Completed {i + 1}/{num_queries} queries...")
 
-        total_time = time.time() - start_time
+        total_time = time.perf_counter() - start_time
         self.results['total_time'] = total_time
 
         print(f"Completed in {total_time:.2f} seconds")
 
-    def concurrent_benchmark(self, domains, num_queries, max_workers=10):
-        """Run concurrent queries."""
-        print(f"\n=== Concurrent Benchmark ({num_queries} queries, {max_workers} threads) ===")
+    def open_connections(self, count):
+        """Open persistent connections to the local server for pipelining."""
+        return [self.client.open_connection() for _ in range(count)]
 
-        start_time = time.time()
+    def _pipelined_queries(self, domains, socks, depth=32, timeout=5.0):
+        """Resolve domains pipelined over persistent connections.
 
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = []
-            for i in range(num_queries):
-                domain = random.choice(domains)
-                future = executor.submit(self.single_query, domain)
-                futures.append(future)
+        Domains are spread round-robin over the sockets. Each socket keeps
+        up to depth queries in flight: pending queries are written
+        back-to-back, then a single-threaded epoll loop over the
+        non-blocking sockets drains whichever responses are ready and the
+        window is refilled. Sockets are closed once their share of queries
+        is answered.
 
-            completed = 0
-            for future in as_completed(futures):
-                result = future.result()
+        Args:
+            domains: Domain names to resolve, one query each.
+            socks: Connected sockets from open_connections.
+            depth: Maximum outstanding queries per connection.
+            timeout: Seconds without any socket activity before all
+                outstanding queries are failed.
+
+        Yields:
+            Result dictionaries shaped like single_query's, in completion
+            order. time_ns runs from submit to that query's response; it is
+            None for queries that were never sent because their connection
+            failed first, and for responses whose id matches no outstanding
+            query (reported as failures).
+        """
+        sel = getattr(selectors, 'EpollSelector', selectors.DefaultSelector)()
+        query_id = 0
+
+        def submit(key):
+            nonlocal query_id
+            backlog, _, tx, in_flight = key.data
+            while backlog and len(in_flight) < depth:
+                query_id += 1
+                domain = backlog.popleft()
+                tx += DNSMessage.serialize_query(query_id, domain)
+                in_flight[query_id] = (domain, time.perf_counter_ns())
+            flush(key)
+
+        def flush(key):
+            tx = key.data[2]
+            if tx:
+                try:
+                    del tx[:key.fileobj.send(tx)]
+                except BlockingIOError:
+                    pass
+                except OSError:
+                    # The connection is gone; the read side reports it
+                    tx.clear()
+            events = selectors.EVENT_READ | (selectors.EVENT_WRITE if tx else 0)
+            if events != key.events:
+                sel.modify(key.fileobj, events, key.data)
+
+        def fail(key, reason):
+            backlog, _, _, in_flight = key.data
+            now = time.perf_counter_ns()
+            for domain, start in in_flight.values():
+                yield {'domain': domain, 'result': reason,
+                       'time_ns': now - start, 'success': False}
+            for domain in backlog:
+                yield {'domain': domain, 'result': reason,
+                       'time_ns': None, 'success': False}
+            sel.unregister(key.fileobj)
+            key.fileobj.close()
+
+        for i, sock in enumerate(socks):
+            backlog = deque(domains[i::len(socks)])
+            if not backlog:
+                sock.close()
+                continue
+            sock.setblocking(False)
+            key = sel.register(sock, selectors.EVENT_READ, (backlog, bytearray(), bytearray(), {}))
+            submit(key)
+
+        while sel.get_map():
+            ready = sel.select(timeout)
+            if not ready:
+                for key in list(sel.get_map().values()):
+                    yield from fail(key, "Timed out")
+                break
+
+            for key, mask in ready:
+                sock = key.fileobj
+                backlog, rx, _, in_flight = key.data
+
+                if mask & selectors.EVENT_WRITE:
+                    flush(sel.get_key(sock))
+                if not mask & selectors.EVENT_READ:
+                    continue
 
-                self.results['total_queries'] += 1
-                self.results['query_times'].append(result['time_ms'])
+                try:
+                    chunk = sock.recv(65536)
+                except BlockingIOError:
+                    continue
+                except OSError as e:
+                    yield from fail(key, str(e))
+                    continue
+                if not chunk:
+                    yield from fail(key, "Connection closed")
+                    continue
 
-                if result['success']:
-                    self.results['successful_queries'] += 1
+                rx += chunk
+                while True:
+                    body = pop_message(rx)
+                    if body is None:
+                        break
+                    qid, domain, code, value = DNSMessage.deserialize_response_fields(body)
+                    pending = in_flight.pop(qid, None)
+                    if pending is None:
+                        # Not a query this connection has outstanding; report
+                        # it as an error without a latency and keep going
+                        yield {'domain': domain.decode(), 'result': f"Unexpected response id {qid}",
+                               'time_ns': None, 'success': False}
+                        continue
+                    domain, start = pending
+                    elapsed = time.perf_counter_ns() - start
+                    yield {'domain': domain, 'result': value.decode(), 'time_ns': elapsed,
+                           'success': code == b'I'}
+
+                if not backlog and not in_flight:
+                    sel.unregister(sock)
+                    sock.close()
                 else:
-                    self.results['failed_queries'] += 1
+                    submit(sel.get_key(sock))
+
+        sel.close()
+
+    def concurrent_benchmark(self, domains, num_queries, max_workers=10, distribution='uniform'):
+        """Run concurrent queries pipelined over max_workers connections."""
+        print(f"\n=== Concurrent Benchmark ({num_queries} queries, {max_workers} connections, "
+              f"{distribution}) ===")
+
+        picks = choose_domains(domains, num_queries, distribution)
+        socks = self.open_connections(max_workers)
+        times = self.results['query_times']
+
+        start_time = time.perf_counter()
+
+        completed = 0
+        for result in self._pipelined_queries(picks, socks):
+            self.results['total_queries'] += 1
+            if result['time_ns'] is not None:
+                times.record_value(result['time_ns'])
 
-                completed += 1
-                if completed % 100 == 0:
-                    print(f"Completed {completed}/{num_queries} queries...")
+            if result['success']:
+                self.results['successful_queries'] += 1
+            else:
+                self.results['failed_queries'] += 1
+
+            completed += 1
+            if completed % 100 == 0:
+                print(f"Completed {completed}/{num_queries} queries...")
 
-        total_time = time.time() - start_time
+        total_time = time.perf_counter() - start_time
         self.results['total_time'] = total_time
 
         print(f"Completed in {total_time:.2f} seconds")
@@ -148,25 +399,37 @@ class DNSBenchmark:
         first_pass_times = []
         cached_times = []
 
+        # The cache fills are independent, so the first pass sends every
+        # domain at once on its own connection; each sample still runs from
+        # that query's submit to its own response.
         print("First pass (populating cache)...")
-        for domain in domains:
-            result = self.single_query(domain)
-            first_pass_times.append(result['time_ms'])
+        socks = self.open_connections(len(domains))
+        for result in self._pipelined_queries(domains, socks):
+            if result['time_ns'] is not None:
+                first_pass_times.append(result['time_ns'])
             self.results['total_queries'] += 1
             if result['success']:
                 self.results['successful_queries'] += 1
+            else:
+                self.results['failed_queries'] += 1
 
         for iteration in range(1, iterations):
             print(f"Pass {iteration + 1} (cached queries)...")
             for domain in domains:
                 result = self.single_query(domain)
-                cached_times.append(result['time_ms'])
+                cached_times.append(result['time_ns'])
                 self.results['total_queries'] += 1
                 if result['success']:
                     self.results['successful_queries'] += 1
+                else:
+                    self.results['failed_queries'] += 1
 
-        avg_first = sum(first_pass_times) / len(first_pass_times)
-        avg_cached = sum(cached_times) / len(cached_times)
+        if not first_pass_times or not cached_times:
+            print("\nNo timed queries; skipping cache comparison")
+            return
+
+        avg_first = sum(first_pass_times) / len(first_pass_times) / NS_PER_MS
+        avg_cached = sum(cached_times) / len(cached_times) / NS_PER_MS
         improvement = ((avg_first - avg_cached) / avg_first) * 100
 
         print(f"\nCache Performance:")
@@ -174,8 +437,8 @@ class DNSBenchmark:
         print(f"  Avg cached query time: {avg_cached:.2f} ms")
         print(f"  Performance improvement: {improvement:.1f}%")
 
-        self.results['query_times'].extend(first_pass_times)
-        self.results['query_times'].extend(cached_times)
+        for elapsed in first_pass_times + cached_times:
+            self.results['query_times'].record_value(elapsed)
 
     def print_results(self):
         """Print benchmark results."""
@@ -193,27 +456,33 @@ class DNSBenchmark:
             print(f"\nTotal Time: {self.results['total_time']:.2f} seconds")
             print(f"Queries Per Second: {qps:.2f}")
 
-        if self.results['query_times']:
-            avg_time = sum(self.results['query_times']) / len(self.results['query_times'])
-            min_time = min(self.results['query_times'])
-            max_time = max(self.results['query_times'])
-            sorted_times = sorted(self.results['query_times'])
-            p50 = sorted_times[len(sorted_times) // 2]
-            p95 = sorted_times[int(len(sorted_times) * 0.95)]
-            p99 = sorted_times[int(len(sorted_times) * 0.99)]
+        times = self.results['query_times']
+        if times.total_count:
+            avg_time = times.total / times.total_count / NS_PER_MS
+            min_time = times.min_value / NS_PER_MS
+            max_time = times.max_value / NS_PER_MS
+            pct = {p: times.get_value_at_percentile(p) / NS_PER_MS for p in PERCENTILES}
 
             print(f"\nLatency Statistics:")
             print(f"  Average: {avg_time:.2f} ms")
             print(f"  Min: {min_time:.2f} ms")
             print(f"  Max: {max_time:.2f} ms")
-            print(f"  P50 (median): {p50:.2f} ms")
-            print(f"  P95: {p95:.2f} ms")
-            print(f"  P99: {p99:.2f} ms")
+            print(f"  P50 (median): {pct[50]:.2f} ms")
+            print(f"  P95: {pct[95]:.2f} ms")
+            print(f"  P99: {pct[99]:.2f} ms")
+            print(f"  P99.9: {pct[99.9]:.2f} ms")
 
         print(f"{'='*60}\n")
 
 
 def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='DNS System Benchmark')
+    parser.add_argument('--distribution', choices=DISTRIBUTIONS, default='uniform',
+                        help='Domain popularity distribution for the load tests')
+    args = parser.parse_args()
+
     print("DNS System Benchmark")
     print("=" * 60)
 
@@ -226,9 +495,10 @@ def main():
     test_domains = random.sample(domains, min(20, len(domains)))
     benchmark.cache_effectiveness_test(test_domains, iterations=5)
 
-    benchmark.sequential_benchmark(domains, num_queries=200)
+    benchmark.sequential_benchmark(domains, num_queries=200, distribution=args.distribution)
 
-    benchmark.concurrent_benchmark(domains, num_queries=500, max_workers=20)
+    benchmark.concurrent_benchmark(domains, num_queries=500, max_workers=20,
+                                   distribution=args.distribution)
 
     benchmark.print_results()
 
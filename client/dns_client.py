@@ -4,17 +4,139 @@
 Provides command line interface for resolving domain names to IP addresses.
 """
 
+import contextlib
+import json
 import socket
 import sys
 import os
+import queue
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from dns_protocol import DNSMessage
+from dns_protocol import DNSMessage, recv_message, STATS_DOMAIN
+
+# Status codes returned by DNSClient.resolve
+STATUS_IP = 0
+STATUS_NS = 1
+STATUS_ERROR = 2
+STATUS_STATS = 3
+
+# Most queries a session keeps unanswered on its connection. Bounding the
+# window keeps both directions' data within the socket buffers, so neither
+# side can block in send while the other is blocked in send too.
+PIPELINE_DEPTH = 32
+
+_STATUS_BY_CODE = {b'I': STATUS_IP, b'N': STATUS_NS, b'E': STATUS_ERROR, b'S': STATUS_STATS}
+
+
+def _parse_stats(result):
+    """Decode the (status, value) answer to a STATS_DOMAIN query.
+
+    Returns:
+        Dict of local server counters, or None if the query failed.
+    """
+    status, value = result
+    if status != STATUS_STATS:
+        return None
+    return json.loads(value)
+
+
+class DNSSession:
+    """Queries sent over one connection pinned for the session's lifetime.
+
+    Obtained from DNSClient.session(). If the connection fails it is
+    closed and the next query opens a new one.
+
+    Attributes:
+        client: DNSClient that owns the session and numbers its queries.
+    """
+
+    def __init__(self, client, sock):
+        self.client = client
+        self._sock = sock
+
+    def _drop(self):
+        """Close the connection, which may hold unread responses."""
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def resolve(self, domain):
+        """Resolve one domain on the session's connection.
+
+        Returns:
+            Tuple (status, value) as from DNSClient.resolve().
+        """
+        return self.resolve_many([domain])[0]
+
+    def stats(self):
+        """Fetch the local server's counters on the session's connection.
+
+        Because queries on a connection are answered in order, the counters
+        already include every query this session sent before the call.
+
+        Returns:
+            Dict with "queries", "hits", "misses", "cache_size", "max_size"
+            and "ttl", or None if the query failed.
+        """
+        return _parse_stats(self.resolve(STATS_DOMAIN))
+
+    def resolve_many(self, domains):
+        """Pipeline several queries over the session's connection.
+
+        The local server answers queries on a connection in order. Up to
+        PIPELINE_DEPTH queries are sent back to back, and the window is
+        topped up with one send whenever half of it has been answered, so
+        lists of any length cost about len(domains) / (PIPELINE_DEPTH / 2)
+        sends and len(domains) reads.
+
+        Args:
+            domains: Domain names to resolve.
+
+        Returns:
+            List of (status, value) tuples in the order of domains.
+        """
+        client = self.client
+        results = []
+        try:
+            queries = []
+            for domain in domains:
+                client.query_id += 1
+                queries.append(DNSMessage.serialize_query(client.query_id, domain))
+            if self._sock is None:
+                self._sock = client.open_connection()
+            sent = 0
+            for _ in domains:
+                if sent < len(queries) and sent - len(results) <= PIPELINE_DEPTH // 2:
+                    end = min(len(queries), len(results) + PIPELINE_DEPTH)
+                    self._sock.sendall(b''.join(queries[sent:end]))
+                    sent = end
+                data = recv_message(self._sock)
+                if data is None:
+                    raise ConnectionError("No response")
+                _, _, code, value = DNSMessage.deserialize_response_fields(data)
+                results.append((_STATUS_BY_CODE[code], value.decode()))
+        except Exception as e:
+            self._drop()
+            results.extend([(STATUS_ERROR, str(e))] * (len(domains) - len(results)))
+        return results
+
+    def close(self):
+        """Hand the connection back to the client's idle pool."""
+        if self._sock is not None:
+            self.client._pool.put(self._sock)
+            self._sock = None
 
 
 class DNSClient:
     """DNS client that queries local server.
 
+    Connections to the local server are persistent: each call to resolve()
+    checks a connected socket out of an idle pool (opening a new one only
+    when the pool is empty) and returns it afterwards, so sequential use
+    shares one socket and N concurrent callers share N sockets. A pooled
+    connection that fails is discarded and the query retried once on a
+    fresh one, so a Local Server restart costs no failed queries.
+
     Attributes:
         local_server: (host, port) tuple for local DNS server.
         query_id: Incrementing query identifier.
@@ -23,6 +145,60 @@ class DNSClient:
     def __init__(self, local_server=('127.0.0.1', 53004)):
         self.local_server = local_server
         self.query_id = 0
+        self._pool = queue.Queue()
+
+    def open_connection(self):
+        """Connect a new socket to the local server.
+
+        Nagle's algorithm is disabled so small queries are sent immediately
+        instead of waiting on the server's delayed ACK, and on Linux
+        TCP_QUICKACK is requested as well.
+
+        Returns:
+            Connected TCP socket.
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if hasattr(socket, 'TCP_QUICKACK'):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+        sock.connect(self.local_server)
+        return sock
+
+    def _checkout(self):
+        """Take an idle connection from the pool, connecting if none is free."""
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            return self.open_connection()
+
+    def close(self):
+        """Close all idle pooled connections."""
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+    @contextlib.contextmanager
+    def session(self):
+        """Pin one pooled connection for a block of queries.
+
+        Example:
+            with client.session() as s:
+                for domain in domains:
+                    s.resolve(domain)
+
+        Yields:
+            DNSSession whose connection returns to the pool on exit.
+        """
+        session = DNSSession(self, self._checkout())
+        try:
+            yield session
+        except BaseException:
+            session._drop()
+            raise
+        session.close()
 
     def resolve(self, domain):
         """Resolve domain name to IP address.
@@ -31,32 +207,75 @@ class DNSClient:
             domain: Domain name to resolve.
 
         Returns:
-            IP address string or error message prefixed with "ERROR:".
+            Tuple (status, value): status is STATUS_IP, STATUS_NS,
+            STATUS_ERROR or STATUS_STATS and value is the IP address,
+            referral, error message or statistics JSON string.
         """
         self.query_id += 1
-
-        query = DNSMessage("QUERY", self.query_id, domain)
+        try:
+            query = DNSMessage.serialize_query(self.query_id, domain)
+        except Exception as e:
+            return STATUS_ERROR, str(e)
 
         try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.connect(self.local_server)
+            sock = self._pool.get_nowait()
+            reused = True
+        except queue.Empty:
+            sock = None
+            reused = False
+
+        while True:
+            try:
+                if sock is None:
+                    sock = self.open_connection()
+                sock.sendall(query)
+                data = recv_message(sock)
+                if data is None:
+                    raise ConnectionError("No response")
+                _, _, code, value = DNSMessage.deserialize_response_fields(data)
+            except Exception as e:
+                if sock is not None:
+                    sock.close()
+                if not reused:
+                    return STATUS_ERROR, str(e)
+                # The pooled connection went stale (e.g. the server
+                # restarted); retry once on a fresh one
+                sock = None
+                reused = False
+                continue
+            self._pool.put(sock)
+            return _STATUS_BY_CODE[code], value.decode()
 
-            sock.sendall(query.serialize())
+    def stats(self):
+        """Fetch the local server's counters.
 
-            data = sock.recv(1024)
-            sock.close()
+        Returns:
+            Dict with "queries", "hits", "misses", "cache_size", "max_size"
+            and "ttl", or None if the query failed.
+        """
+        return _parse_stats(self.resolve(STATS_DOMAIN))
 
-            if data:
-                response = DNSMessage.deserialize(data)
+    def stdin_mode(self, stream=sys.stdin):
+        """Resolve one domain per input line and print one result per line.
 
-                if response.result_type == "IP":
-                    return response.result_value
-                else:
-                    return f"ERROR: {response.result_value}"
-        except Exception as e:
-            return f"ERROR: {e}"
+        Lets shell pipelines resolve many domains with a single interpreter
+        and a single pooled connection, e.g.
+        ``cat hosts.txt | python3 dns_client.py --stdin``. Output is flushed
+        per line so the client can be driven interactively by another
+        process.
 
-        return "ERROR: No response"
+        Args:
+            stream: Text stream to read domains from.
+        """
+        for line in stream:
+            domain = line.strip()
+            if not domain:
+                continue
+            status, value = self.resolve(domain)
+            if status in (STATUS_IP, STATUS_STATS):
+                print(f"{domain} -> {value}", flush=True)
+            else:
+                print(f"{domain} -> ERROR: {value}", flush=True)
 
     def interactive_mode(self):
         """Run interactive command line interface."""
@@ -76,8 +295,11 @@ class DNSClient:
                     continue
 
                 print(f"Resolving {domain}...")
-                ip = self.resolve(domain)
-                print(f"Result: {domain} -> {ip}")
+                status, value = self.resolve(domain)
+                if status in (STATUS_IP, STATUS_STATS):
+                    print(f"Result: {domain} -> {value}")
+                else:
+                    print(f"Result: {domain} -> ERROR: {value}")
                 print()
 
             except KeyboardInterrupt:
@@ -95,14 +317,21 @@ if __name__ == "__main__":
                         help='Local DNS server host')
     parser.add_argument('--server-port', type=int, default=53004,
                         help='Local DNS server port')
+    parser.add_argument('--stdin', action='store_true',
+                        help='Read domains line by line from standard input')
     parser.add_argument('domain', nargs='?', help='Domain to resolve')
 
     args = parser.parse_args()
 
     client = DNSClient(local_server=(args.server_host, args.server_port))
 
-    if args.domain:
-        ip = client.resolve(args.domain)
-        print(f"{args.domain} -> {ip}")
+    if args.stdin:
+        client.stdin_mode()
+    elif args.domain:
+        status, value = client.resolve(args.domain)
+        if status in (STATUS_IP, STATUS_STATS):
+            print(f"{args.domain} -> {value}")
+        else:
+            print(f"{args.domain} -> ERROR: {value}")
     else:
         client.interactive_mode()
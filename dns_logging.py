@@ -0,0 +1,66 @@
+"""Background logging for the DNS servers.
+
+Servers log through the standard logging module with loggers named after
+their tag (e.g. logging.getLogger("ROOT")). setup_logging() installs a
+QueueHandler on the root logger and a QueueListener thread that writes the
+records to stdout as "[TAG] message", so request handlers only enqueue a
+record and never block on stdout. Messages use %-style arguments; they are
+formatted on the listener thread, not in the handler.
+"""
+
+import logging
+import logging.handlers
+import queue
+import sys
+
+# Records waiting for the writer thread; further records are dropped
+LOG_QUEUE_SIZE = 10000
+
+_listener = None
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that defers formatting and drops records when full."""
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+
+def setup_logging(level=logging.INFO):
+    """Start the background log writer for this process.
+
+    Calling it again is a no-op.
+
+    Args:
+        level: Minimum level logged by the root logger.
+
+    Returns:
+        The running QueueListener.
+    """
+    global _listener
+    if _listener is None:
+        log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        stream = logging.StreamHandler(sys.stdout)
+        stream.setFormatter(logging.Formatter("[%(name)s] %(message)s"))
+
+        root = logging.getLogger()
+        root.addHandler(_DroppingQueueHandler(log_queue))
+        root.setLevel(level)
+
+        _listener = logging.handlers.QueueListener(log_queue, stream)
+        _listener.start()
+    return _listener
+
+
+def stop_logging():
+    """Write out every queued record and stop the background writer."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
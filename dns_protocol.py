@@ -1,12 +1,225 @@
 """DNS protocol message format implementation.
 
-Simplified DNS protocol using pipe-delimited encoding.
+Simplified DNS protocol using fixed binary headers packed with struct.
 
-Wire format:
-    QUERY:    QUERY|<query_id>|<domain_name>
-    RESPONSE: RESPONSE|<query_id>|<domain_name>|<result_type>|<result_value>
+Wire format (all integers big-endian):
+    QUERY:    type=0 (u8) | query_id (u32) | domain_len (u16) | domain
+    RESPONSE: type=1 (u8) | query_id (u32) | domain_len (u16) |
+              result_type (1 char: I, N, E or S) | value_len (u16) |
+              domain | result_value
+
+Domains and result values are UTF-8 text, matching how they are decoded,
+so any name a client can send can also be forwarded and answered.
+
+Every message is preceded by a 2-byte big-endian length prefix, as in
+standard DNS over TCP (RFC 1035, section 4.2.2), so several messages can
+travel back-to-back over one persistent TCP connection. A message body is
+therefore at most 65535 bytes.
+
+A query for STATS_DOMAIN asks the Local Server for its cache statistics;
+the answer has result type STATS and a JSON object as its value.
+
+The module is fully type-annotated so it can be compiled ahead of time with
+mypyc (``mypyc dns_protocol.py``); the resulting extension module is picked
+up in place of this file without any change to importers.
 """
 
+import asyncio
+import socket
+import struct
+from typing import Dict, Optional, Tuple
+
+_LENGTH = struct.Struct('!H')
+LENGTH_PREFIX_SIZE = _LENGTH.size
+
+# Size of the reusable per-connection receive buffers passed to recv_message;
+# large enough for any message the 2-byte length prefix can describe
+RECV_BUFFER_SIZE = 65535
+
+# Pseudo-domain answered by the Local Server with its statistics
+STATS_DOMAIN = '__stats__'
+
+MSG_QUERY = 0
+MSG_RESPONSE = 1
+
+_QUERY = struct.Struct('!BIH')
+_RESPONSE = struct.Struct('!BIHcH')
+_QUERY_FRAME = struct.Struct('!HBIH')
+_RESPONSE_FRAME = struct.Struct('!HBIHcH')
+
+# Bound struct methods and sizes for the per-message hot paths
+_QUERY_SIZE = _QUERY.size
+_RESPONSE_SIZE = _RESPONSE.size
+_unpack_query = _QUERY.unpack_from
+_unpack_response = _RESPONSE.unpack_from
+_pack_query_frame = _QUERY_FRAME.pack
+_pack_response_frame = _RESPONSE_FRAME.pack
+
+_HAS_SENDMSG = hasattr(socket.socket, 'sendmsg')
+
+# Makes a blocking recv wait for the full requested size in the kernel
+_MSG_WAITALL = getattr(socket, 'MSG_WAITALL', 0)
+
+_RESULT_CODES: Dict[str, bytes] = {"IP": b'I', "NS": b'N', "ERROR": b'E', "STATS": b'S'}
+_RESULT_TYPES: Dict[bytes, str] = {code: name for name, code in _RESULT_CODES.items()}
+
+
+def recv_exact(sock: socket.socket, size: int) -> bytes:
+    """Read exactly size bytes from a stream socket.
+
+    Reads with MSG_WAITALL, like recv_exact_into.
+
+    Args:
+        sock: Connected blocking stream socket.
+        size: Number of bytes to read.
+
+    Returns:
+        Bytes of the requested size, or b'' if the peer closed the
+        connection before sending anything.
+
+    Raises:
+        ConnectionError: If the peer closed the connection mid-read.
+    """
+    buf = bytearray()
+    while len(buf) < size:
+        chunk = sock.recv(size - len(buf), _MSG_WAITALL)
+        if not chunk:
+            if buf:
+                raise ConnectionError("Connection closed mid-message")
+            return b''
+        buf += chunk
+    return bytes(buf)
+
+
+def recv_exact_into(sock: socket.socket, view: memoryview) -> bool:
+    """Fill a writable buffer completely from a stream socket.
+
+    Reads with MSG_WAITALL, so on a blocking socket the kernel normally
+    fills the buffer in one call; the loop only continues after a signal
+    or other early return.
+
+    Args:
+        sock: Connected blocking stream socket.
+        view: Writable memoryview to fill.
+
+    Returns:
+        True once view is full, or False if the peer closed the connection
+        before sending anything.
+
+    Raises:
+        ConnectionError: If the peer closed the connection mid-read.
+    """
+    size = len(view)
+    got = 0
+    while got < size:
+        n = sock.recv_into(view[got:], 0, _MSG_WAITALL)
+        if not n:
+            if got:
+                raise ConnectionError("Connection closed mid-message")
+            return False
+        got += n
+    return True
+
+
+def recv_message(sock: socket.socket, view: Optional[memoryview] = None) -> Optional[bytes]:
+    """Read one length-prefixed message body from a stream socket.
+
+    Args:
+        sock: Connected stream socket.
+        view: Optional memoryview over a reusable bytearray. When given,
+            the prefix and body are read into it with recv_into, so the
+            only allocation per message is the returned body; bodies
+            larger than the buffer fall back to recv_exact.
+
+    Returns:
+        Message body bytes (without the length prefix), or None if the
+        peer closed the connection cleanly.
+
+    Raises:
+        ConnectionError: If the peer closed the connection mid-message.
+    """
+    if view is None:
+        header = recv_exact(sock, LENGTH_PREFIX_SIZE)
+        if not header:
+            return None
+        (length,) = _LENGTH.unpack(header)
+        return recv_exact(sock, length)
+
+    if not recv_exact_into(sock, view[:LENGTH_PREFIX_SIZE]):
+        return None
+    (length,) = _LENGTH.unpack_from(view)
+    if length > len(view):
+        return recv_exact(sock, length)
+    if not recv_exact_into(sock, view[:length]):
+        raise ConnectionError("Connection closed mid-message")
+    return bytes(view[:length])
+
+
+def send_parts(sock: socket.socket, parts: Tuple[bytes, ...]) -> None:
+    """Send several buffers back to back with one gathering sendmsg call.
+
+    The kernel copies straight from each buffer, so no joined bytes object
+    is built in Python. If the kernel accepts only part of the data, or
+    sendmsg is unavailable, the rest goes out with sendall.
+
+    Args:
+        sock: Connected stream socket.
+        parts: Buffers forming one or more whole messages.
+    """
+    if _HAS_SENDMSG:
+        sent = sock.sendmsg(parts)
+        if sent == sum(map(len, parts)):
+            return
+        sock.sendall(b''.join(parts)[sent:])
+    else:
+        sock.sendall(b''.join(parts))
+
+
+async def read_message(reader: asyncio.StreamReader) -> Optional[bytes]:
+    """Read one length-prefixed message body from an asyncio stream.
+
+    Args:
+        reader: StreamReader of a connected client.
+
+    Returns:
+        Message body bytes (without the length prefix), or None if the
+        peer closed the connection cleanly.
+
+    Raises:
+        ConnectionError: If the peer closed the connection mid-message.
+    """
+    try:
+        header = await reader.readexactly(LENGTH_PREFIX_SIZE)
+    except asyncio.IncompleteReadError as e:
+        if not e.partial:
+            return None
+        raise ConnectionError("Connection closed mid-message") from None
+    (length,) = _LENGTH.unpack(header)
+    try:
+        return await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        raise ConnectionError("Connection closed mid-message") from None
+
+
+def pop_message(buf: bytearray) -> Optional[bytes]:
+    """Remove and return the first complete message body from a receive buffer.
+
+    Args:
+        buf: bytearray accumulating raw bytes read from a stream socket.
+
+    Returns:
+        Message body bytes, or None if buf does not yet hold a whole message.
+    """
+    if len(buf) < LENGTH_PREFIX_SIZE:
+        return None
+    (length,) = _LENGTH.unpack_from(buf)
+    end = LENGTH_PREFIX_SIZE + length
+    if len(buf) < end:
+        return None
+    body = bytes(buf[LENGTH_PREFIX_SIZE:end])
+    del buf[:end]
+    return body
+
 
 class DNSMessage:
     """DNS protocol message for queries and responses.
@@ -15,64 +228,229 @@ class DNSMessage:
         msg_type: "QUERY" or "RESPONSE".
         query_id: Unique identifier for matching queries to responses.
         domain: Fully qualified domain name.
-        result_type: "IP", "NS", or "ERROR" for responses, None for queries.
+        result_type: "IP", "NS", "ERROR" or "STATS" for responses, None for
+            queries.
         result_value: Result data for responses, None for queries.
     """
 
-    def __init__(self, msg_type, query_id, domain, result_type=None, result_value=None):
+    __slots__ = ("msg_type", "query_id", "domain", "result_type", "result_value")
+
+    def __init__(self, msg_type: str, query_id: int, domain: str,
+                 result_type: Optional[str] = None, result_value: Optional[str] = None) -> None:
         self.msg_type = msg_type
         self.query_id = query_id
         self.domain = domain
         self.result_type = result_type
         self.result_value = result_value
 
-    def serialize(self):
+    def serialize(self) -> bytes:
         """Convert message to wire format bytes.
 
         Returns:
-            Pipe-delimited UTF-8 encoded bytes.
+            Length-prefixed binary message bytes.
 
         Raises:
-            ValueError: If msg_type is invalid.
+            ValueError: If msg_type is invalid or a response has no
+                result_type.
         """
+        domain = self.domain.encode('utf-8')
+        domain_len = len(domain)
+        if self.msg_type == "RESPONSE":
+            if self.result_type is None:
+                raise ValueError("Response has no result type")
+            value = str(self.result_value).encode('utf-8')
+            return _pack_response_frame(_RESPONSE_SIZE + domain_len + len(value), MSG_RESPONSE,
+                                        self.query_id, domain_len, _RESULT_CODES[self.result_type],
+                                        len(value)) + domain + value
         if self.msg_type == "QUERY":
-            return f"QUERY|{self.query_id}|{self.domain}".encode('utf-8')
-        elif self.msg_type == "RESPONSE":
-            return f"RESPONSE|{self.query_id}|{self.domain}|{self.result_type}|{self.result_value}".encode('utf-8')
-        else:
-            raise ValueError(f"Unknown message type: {self.msg_type}")
+            return _pack_query_frame(_QUERY_SIZE + domain_len, MSG_QUERY,
+                                     self.query_id, domain_len) + domain
+        raise ValueError(f"Unknown message type: {self.msg_type}")
+
+    @staticmethod
+    def serialize_query(query_id: int, domain: str) -> bytes:
+        """Build wire bytes for a query without constructing a DNSMessage.
+
+        Equivalent to DNSMessage("QUERY", query_id, domain).serialize(),
+        with the length prefix and header packed in a single call.
+
+        Returns:
+            Length-prefixed binary query bytes.
+        """
+        encoded = domain.encode('utf-8')
+        return _pack_query_frame(_QUERY_SIZE + len(encoded), MSG_QUERY,
+                                 query_id, len(encoded)) + encoded
+
+    @staticmethod
+    def serialize_response(query_id: int, domain: bytes, result_code: bytes, value: bytes) -> bytes:
+        """Build wire bytes for a response from pre-encoded fields.
+
+        Lets servers keep constant result values encoded once instead of
+        building and serializing a DNSMessage per query.
+
+        Args:
+            query_id: Identifier of the query being answered.
+            domain: UTF-8-encoded domain name.
+            result_code: b'I', b'N', b'E' or b'S'.
+            value: UTF-8-encoded result value.
+
+        Returns:
+            Length-prefixed binary response bytes.
+        """
+        return _pack_response_frame(_RESPONSE_SIZE + len(domain) + len(value), MSG_RESPONSE,
+                                    query_id, len(domain), result_code, len(value)) + domain + value
+
+    @staticmethod
+    def serialize_response_parts(query_id: int, domain: bytes, result_code: bytes,
+                                 value: bytes) -> Tuple[bytes, bytes, bytes]:
+        """Build a response as (header, domain, value) buffers for send_parts.
+
+        Same wire bytes as serialize_response, without concatenating them.
+
+        Returns:
+            Tuple of the length-prefixed header, domain and value.
+        """
+        return (_pack_response_frame(_RESPONSE_SIZE + len(domain) + len(value), MSG_RESPONSE,
+                                     query_id, len(domain), result_code, len(value)),
+                domain, value)
+
+    @staticmethod
+    def deserialize_query_fields(data: bytes) -> Tuple[int, bytes]:
+        """Unpack a query body into raw fields without building a DNSMessage.
+
+        Args:
+            data: Query body bytes with the length prefix stripped.
+
+        Returns:
+            Tuple (query_id, domain) where domain is the undecoded UTF-8
+            domain name.
+
+        Raises:
+            ValueError: If data is not a query.
+        """
+        msg_type, query_id, domain_len = _unpack_query(data)
+        if msg_type != MSG_QUERY:
+            raise ValueError(f"Unknown message type: {msg_type}")
+        return query_id, data[_QUERY_SIZE:_QUERY_SIZE + domain_len]
+
+    @staticmethod
+    def deserialize_response_fields(data: bytes) -> Tuple[int, bytes, bytes, bytes]:
+        """Unpack a response body into raw fields without building a DNSMessage.
+
+        Args:
+            data: Response body bytes with the length prefix stripped.
+
+        Returns:
+            Tuple (query_id, domain, result_code, result_value) where domain
+            and result_value are undecoded bytes and result_code is b'I',
+            b'N', b'E' or b'S'.
+
+        Raises:
+            ValueError: If data is not a response.
+        """
+        msg_type, query_id, domain_len, code, value_len = _unpack_response(data)
+        if msg_type != MSG_RESPONSE:
+            raise ValueError(f"Unknown message type: {msg_type}")
+        end = _RESPONSE_SIZE + domain_len
+        return query_id, data[_RESPONSE_SIZE:end], code, data[end:end + value_len]
 
     @staticmethod
-    def deserialize(data):
-        """Parse wire format bytes into DNSMessage.
+    def deserialize(data: bytes) -> "DNSMessage":
+        """Parse a message body into DNSMessage.
 
         Args:
-            data: Raw bytes from network socket.
+            data: Message body bytes with the length prefix already stripped
+                (as returned by recv_message).
 
         Returns:
             Parsed DNSMessage object.
+
+        Raises:
+            ValueError: If the message type byte is invalid.
         """
-        parts = data.decode('utf-8').split('|')
-
-        if parts[0] == "QUERY":
-            return DNSMessage(
-                msg_type="QUERY",
-                query_id=int(parts[1]),
-                domain=parts[2]
-            )
-        elif parts[0] == "RESPONSE":
-            return DNSMessage(
-                msg_type="RESPONSE",
-                query_id=int(parts[1]),
-                domain=parts[2],
-                result_type=parts[3],
-                result_value=parts[4]
-            )
+        # Fields are decoded one slice at a time with the default UTF-8
+        # codec, which CPython fast-paths for ASCII input; nothing else in
+        # the buffer is scanned or copied. Constructor arguments are passed
+        # positionally, which is measurably cheaper than by keyword here.
+        msg_type = data[0]
+
+        if msg_type == MSG_QUERY:
+            _, query_id, domain_len = _unpack_query(data)
+            return DNSMessage("QUERY", query_id,
+                              data[_QUERY_SIZE:_QUERY_SIZE + domain_len].decode())
+        elif msg_type == MSG_RESPONSE:
+            _, query_id, domain_len, code, value_len = _unpack_response(data)
+            end = _RESPONSE_SIZE + domain_len
+            return DNSMessage("RESPONSE", query_id, data[_RESPONSE_SIZE:end].decode(),
+                              _RESULT_TYPES[code], data[end:end + value_len].decode())
         else:
-            raise ValueError(f"Unknown message type: {parts[0]}")
+            raise ValueError(f"Unknown message type: {msg_type}")
 
-    def __str__(self):
+    def __str__(self) -> str:
         if self.msg_type == "QUERY":
             return f"QUERY(id={self.query_id}, domain={self.domain})"
         else:
             return f"RESPONSE(id={self.query_id}, domain={self.domain}, {self.result_type}={self.result_value})"
+
+
+class MessagePool:
+    """Freelist of reusable DNSMessage objects.
+
+    Servers parse each incoming query into a pooled message and take the
+    response from the pool too, releasing both once the response has been
+    serialized, so steady-state query handling allocates no message
+    objects. list.pop and list.append are atomic, so one pool can be
+    shared by all of a server's connection threads.
+
+    Attributes:
+        size: Maximum number of idle messages kept.
+    """
+
+    def __init__(self, size: int = 64) -> None:
+        self.size = size
+        self._free = [DNSMessage.__new__(DNSMessage) for _ in range(size)]
+
+    def _take(self) -> DNSMessage:
+        """Return an idle message, or a new uninitialised one if none is idle."""
+        try:
+            return self._free.pop()
+        except IndexError:
+            return DNSMessage.__new__(DNSMessage)
+
+    def query(self, data: bytes) -> DNSMessage:
+        """Parse a query body into a pooled QUERY message.
+
+        Args:
+            data: Query body bytes with the length prefix stripped.
+
+        Returns:
+            DNSMessage equal to DNSMessage.deserialize(data).
+
+        Raises:
+            ValueError: If data is not a query.
+        """
+        msg_type, query_id, domain_len = _unpack_query(data)
+        if msg_type != MSG_QUERY:
+            raise ValueError(f"Unknown message type: {msg_type}")
+        msg = self._take()
+        msg.msg_type = "QUERY"
+        msg.query_id = query_id
+        msg.domain = data[_QUERY_SIZE:_QUERY_SIZE + domain_len].decode()
+        msg.result_type = None
+        msg.result_value = None
+        return msg
+
+    def response(self, query_id: int, domain: str, result_type: str, result_value: str) -> DNSMessage:
+        """Return a RESPONSE message with the given fields, reusing an idle one if any."""
+        msg = self._take()
+        msg.msg_type = "RESPONSE"
+        msg.query_id = query_id
+        msg.domain = domain
+        msg.result_type = result_type
+        msg.result_value = result_value
+        return msg
+
+    def release(self, msg: DNSMessage) -> None:
+        """Return a message to the pool once it is no longer referenced."""
+        if len(self._free) < self.size:
+            self._free.append(msg)
@@ -4,56 +4,106 @@ Comprehensive DNS System Benchmark
 Generates metrics for resume
 """
 
+import asyncio
 import subprocess
 import time
+import array
+import functools
+import re
+import signal
+import socket
 import sys
 import os
-from client.dns_client import DNSClient
+from collections import deque
+from client.dns_client import DNSClient, STATUS_IP
+from dns_protocol import DNSMessage, LENGTH_PREFIX_SIZE
+from benchmark.benchmark import (DISTRIBUTIONS, NS_PER_MS, PERCENTILES, choose_domains,
+                                 latency_percentiles)
+
+def wait_ready(host, port, timeout=2.0):
+    """Poll until a server accepts TCP connections or timeout elapses"""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection((host, port), timeout=0.05).close()
+            return True
+        except OSError:
+            if time.monotonic() >= deadline:
+                print(f"  WARNING: server on {host}:{port} not ready after {timeout:.1f}s")
+                return False
+            time.sleep(0.01)
+
+# (command, port) for each server, in start order
+SERVERS = [
+    (['python3', '-m', 'servers.root_server'], 53000),
+    (['python3', '-m', 'servers.tld_server', '--tld', 'com', '--port', '53001'], 53001),
+    (['python3', '-m', 'servers.tld_server', '--tld', 'edu', '--port', '53002'], 53002),
+    (['python3', '-m', 'servers.authoritative_server'], 53003),
+    (['python3', '-m', 'servers.local_server'], 53004),
+]
 
 def start_servers():
-    """Start all DNS servers"""
+    """Start all DNS servers and return their process handles"""
     print("Starting DNS infrastructure...")
 
-    # Start servers
-    subprocess.Popen(['python3', 'servers/root_server.py'],
-                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    time.sleep(0.3)
+    # Start servers, each once the previous one is accepting connections
+    procs = []
+    for cmd, port in SERVERS:
+        # Own session per server, so stop_servers can signal its forked
+        # workers along with it
+        procs.append(subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                      start_new_session=True))
+        wait_ready('127.0.0.1', port)
 
-    subprocess.Popen(['python3', 'servers/tld_server.py', '--tld', 'com', '--port', '53001'],
-                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    time.sleep(0.3)
+    print("All servers started!\n")
+    return procs
 
-    subprocess.Popen(['python3', 'servers/tld_server.py', '--tld', 'edu', '--port', '53002'],
-                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    time.sleep(0.3)
+def kill_group(proc, sig):
+    """Send sig to proc's whole process group, including forked workers"""
+    try:
+        os.killpg(proc.pid, sig)
+    except ProcessLookupError:
+        pass
+
+def stop_servers(procs):
+    """Stop the servers started by start_servers and any workers they forked"""
+    for proc in procs:
+        proc.terminate()
+    for proc in procs:
+        try:
+            proc.wait(timeout=1.0)
+        except subprocess.TimeoutExpired:
+            kill_group(proc, signal.SIGKILL)
+            proc.wait()
+        else:
+            # Workers still alive after their parent exited
+            kill_group(proc, signal.SIGKILL)
 
-    subprocess.Popen(['python3', 'servers/authoritative_server.py'],
-                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    time.sleep(0.3)
+# One "domain,ip" record per line; comment and blank lines never match
+_RECORD_RE = re.compile(r'^[ \t]*([^#\s,][^,\n]*?)[ \t]*,[^,\n]*$', re.M)
 
-    subprocess.Popen(['python3', 'servers/local_server.py'],
-                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    time.sleep(1)
+@functools.lru_cache(maxsize=1)
+def load_test_domains():
+    """Load all domains from DNS records file (parsed once, then cached)"""
+    with open('data/dns_records.txt', 'r') as f:
+        return tuple(_RECORD_RE.findall(f.read()))
 
-    print("All servers started!\n")
+# Not in the records file: warmup never populates the cache under test
+WARMUP_DOMAIN = 'warmup.invalid'
+WARMUP_QUERIES = 5
 
-def stop_servers():
-    """Stop all servers"""
-    subprocess.run(['killall', 'python3'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    time.sleep(1)
+def warm_up(client, domain=WARMUP_DOMAIN):
+    """Run untimed queries so cold-start cost stays out of the measurements"""
+    warmup_times = []
+    for _ in range(WARMUP_QUERIES):
+        start = time.perf_counter_ns()
+        client.resolve(domain)
+        warmup_times.append(time.perf_counter_ns() - start)
 
-def load_test_domains():
-    """Load all domains from DNS records file"""
-    domains = []
-    with open('data/dns_records.txt', 'r') as f:
-        for line in f:
-            line = line.strip()
-            if line.startswith('#') or not line:
-                continue
-            parts = line.split(',')
-            if len(parts) == 2:
-                domains.append(parts[0].strip())
-    return domains
+    cold_ms = warmup_times[0] / NS_PER_MS
+    print(f"\nWarmup ({WARMUP_QUERIES} untimed queries): "
+          f"cold {cold_ms:.2f} ms, warm {warmup_times[-1] / NS_PER_MS:.2f} ms")
+    return cold_ms
 
 def test_cache_performance():
     """Test cache hit rate"""
@@ -63,17 +113,18 @@ def test_cache_performance():
 
     client = DNSClient()
     domains = load_test_domains()[:20]  # Use 20 unique domains
+    warmup_ms = warm_up(client)
 
     # First pass - cache misses
     print("\nFirst query (cache miss) times:")
     first_pass_times = []
     for domain in domains:
-        start = time.time()
-        result = client.resolve(domain)
-        elapsed = (time.time() - start) * 1000
+        start = time.perf_counter_ns()
+        status, _ = client.resolve(domain)
+        elapsed = time.perf_counter_ns() - start
         first_pass_times.append(elapsed)
-        if not result.startswith('ERROR'):
-            print(f"  {domain:30s} {elapsed:6.2f} ms")
+        if status == STATUS_IP:
+            print(f"  {domain:30s} {elapsed / NS_PER_MS:6.2f} ms")
 
     # Wait a moment
     time.sleep(0.2)
@@ -82,15 +133,15 @@ def test_cache_performance():
     print("\nCached query times:")
     cached_times = []
     for domain in domains:
-        start = time.time()
-        result = client.resolve(domain)
-        elapsed = (time.time() - start) * 1000
+        start = time.perf_counter_ns()
+        status, _ = client.resolve(domain)
+        elapsed = time.perf_counter_ns() - start
         cached_times.append(elapsed)
-        if not result.startswith('ERROR'):
-            print(f"  {domain:30s} {elapsed:6.2f} ms")
+        if status == STATUS_IP:
+            print(f"  {domain:30s} {elapsed / NS_PER_MS:6.2f} ms")
 
-    avg_first = sum(first_pass_times) / len(first_pass_times)
-    avg_cached = sum(cached_times) / len(cached_times)
+    avg_first = sum(first_pass_times) / len(first_pass_times) / NS_PER_MS
+    avg_cached = sum(cached_times) / len(cached_times) / NS_PER_MS
     improvement = ((avg_first - avg_cached) / avg_first) * 100
 
     print(f"\n{'Results:'}")
@@ -108,23 +159,90 @@ def test_cache_performance():
     cache_misses = 20  # Only first pass were misses
     cache_hits = total_queries - cache_misses
     cache_hit_rate = (cache_hits / total_queries) * 100
+    # Cache settings come from the server itself rather than a copy here
+    stats = client.stats()
+    if stats is None:
+        raise RuntimeError("Local Server did not answer the __stats__ query")
+    cache_max_size = stats['max_size']
+    working_set_ratio = len(domains) / cache_max_size
 
     print(f"\nCache Statistics:")
     print(f"  Total queries: {total_queries}")
     print(f"  Cache hits:    {cache_hits}")
     print(f"  Cache misses:  {cache_misses}")
     print(f"  Hit rate:      {cache_hit_rate:.1f}%")
+    print(f"  Working set:   {len(domains)} domains / {cache_max_size} entries "
+          f"(ratio {working_set_ratio:.3f})")
 
     return {
         'avg_first_query_ms': avg_first,
         'avg_cached_query_ms': avg_cached,
         'cache_improvement_pct': improvement,
         'cache_hit_rate': cache_hit_rate,
-        'total_queries': total_queries
+        'working_set_ratio': working_set_ratio,
+        'cache_max_size': cache_max_size,
+        'cache_ttl': stats['ttl'],
+        'total_queries': total_queries,
+        'warmup_ms': warmup_ms,
     }
 
-def test_throughput():
-    """Test query throughput"""
+THROUGHPUT_WORKERS = 32
+
+async def throughput_worker(reader, writer, jobs, latencies, outcomes, progress):
+    """Drain queries from the shared job deque over one persistent connection
+
+    If the connection fails, the worker stops; its in-flight query keeps
+    outcome None and the other workers carry on with the remaining jobs.
+    """
+    try:
+        while jobs:
+            i, domain = jobs.popleft()
+            query = DNSMessage.serialize_query(i + 1, domain)
+
+            query_start = time.perf_counter_ns()
+            writer.write(query)
+            header = await reader.readexactly(LENGTH_PREFIX_SIZE)
+            body = await reader.readexactly(int.from_bytes(header, 'big'))
+            latencies[i] = time.perf_counter_ns() - query_start
+
+            _, _, code, _ = DNSMessage.deserialize_response_fields(body)
+            outcomes[i] = code == b'I'
+
+            progress[0] += 1
+            if progress[0] % 200 == 0:
+                print(f"  Completed {progress[0]}/{len(latencies)}...")
+    except (OSError, asyncio.IncompleteReadError) as e:
+        print(f"  Connection failed: {e!r}")
+
+async def run_throughput(server, domains, num_queries, latencies, outcomes,
+                         distribution='round-robin'):
+    """Run all queries across THROUGHPUT_WORKERS concurrent connections
+
+    Domains are picked with the named distribution from DISTRIBUTIONS.
+
+    Queries left unanswered, because their connection failed or no
+    connection could be opened, keep outcome None.
+    """
+    jobs = deque(enumerate(choose_domains(domains, num_queries, distribution)))
+    conns = [conn for conn in await asyncio.gather(*(asyncio.open_connection(*server)
+                                                    for _ in range(THROUGHPUT_WORKERS)),
+                                                  return_exceptions=True)
+             if not isinstance(conn, BaseException)]
+    if len(conns) < THROUGHPUT_WORKERS:
+        print(f"  Only {len(conns)}/{THROUGHPUT_WORKERS} connections opened")
+    progress = [0]
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*(throughput_worker(reader, writer, jobs, latencies, outcomes, progress)
+                           for reader, writer in conns))
+    total_time = time.perf_counter() - start_time
+
+    for _, writer in conns:
+        writer.close()
+    return total_time
+
+def test_throughput(distribution='round-robin'):
+    """Test query throughput with the given domain distribution"""
     print("\n" + "=" * 70)
     print("TEST 2: Query Throughput")
     print("=" * 70)
@@ -132,78 +250,79 @@ def test_throughput():
     client = DNSClient()
     domains = load_test_domains()
     num_queries = 1000
+    warmup_ms = warm_up(client, domains[0])
 
-    print(f"\nSending {num_queries} queries...")
-
-    successful = 0
-    failed = 0
-    latencies = []
-
-    start_time = time.time()
-
-    for i in range(num_queries):
-        domain = domains[i % len(domains)]
-        query_start = time.time()
-        result = client.resolve(domain)
-        query_elapsed = (time.time() - query_start) * 1000
+    print(f"\nSending {num_queries} {distribution}-distributed queries over {THROUGHPUT_WORKERS} "
+          f"concurrent connections...")
 
-        latencies.append(query_elapsed)
+    latencies = array.array('q', bytes(8 * num_queries))
+    # True/False once answered; None if the query never got a response
+    outcomes = [None] * num_queries
 
-        if not result.startswith('ERROR'):
-            successful += 1
-        else:
-            failed += 1
-
-        if (i + 1) % 200 == 0:
-            print(f"  Completed {i + 1}/{num_queries}...")
+    total_time = asyncio.run(run_throughput(client.local_server, domains, num_queries,
+                                            latencies, outcomes, distribution))
+    successful = sum(1 for ok in outcomes if ok)
+    failed = num_queries - successful
 
-    total_time = time.time() - start_time
     qps = num_queries / total_time
 
-    latencies_sorted = sorted(latencies)
-    avg_latency = sum(latencies) / len(latencies)
-    p50 = latencies_sorted[len(latencies_sorted) // 2]
-    p95 = latencies_sorted[int(len(latencies_sorted) * 0.95)]
-    p99 = latencies_sorted[int(len(latencies_sorted) * 0.99)]
+    # Only answered queries have a latency
+    answered = array.array('q', (ns for ns, ok in zip(latencies, outcomes) if ok is not None))
+    if answered:
+        avg_latency = sum(answered) / len(answered) / NS_PER_MS
+        pct = {p: v / NS_PER_MS for p, v in latency_percentiles(answered).items()}
+    else:
+        avg_latency = 0.0
+        pct = dict.fromkeys(PERCENTILES, 0.0)
+    p95 = pct[95]
 
     print(f"\nResults:")
+    print(f"  Distribution:      {distribution}")
     print(f"  Total queries:     {num_queries}")
     print(f"  Successful:        {successful}")
     print(f"  Failed:            {failed}")
     print(f"  Total time:        {total_time:.2f} seconds")
     print(f"  Queries/second:    {qps:.2f}")
     print(f"  Avg latency:       {avg_latency:.2f} ms")
-    print(f"  P50 latency:       {p50:.2f} ms")
+    print(f"  P50 latency:       {pct[50]:.2f} ms")
     print(f"  P95 latency:       {p95:.2f} ms")
-    print(f"  P99 latency:       {p99:.2f} ms")
+    print(f"  P99 latency:       {pct[99]:.2f} ms")
+    print(f"  P99.9 latency:     {pct[99.9]:.2f} ms")
 
     return {
+        'distribution': distribution,
         'total_queries': num_queries,
         'successful': successful,
         'qps': qps,
         'avg_latency_ms': avg_latency,
         'p95_latency_ms': p95,
+        'warmup_ms': warmup_ms,
     }
 
 def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Comprehensive DNS System Benchmark')
+    parser.add_argument('--distribution', choices=DISTRIBUTIONS, default='round-robin',
+                        help='Domain distribution for the throughput test (default: '
+                             'round-robin over the records, as in earlier runs)')
+    args = parser.parse_args()
+
     print("\n")
     print("*" * 70)
     print("DNS SYSTEM - COMPREHENSIVE PERFORMANCE BENCHMARK")
     print("*" * 70)
     print()
 
-    # Clean up any existing servers
-    stop_servers()
-
     # Start fresh servers
-    start_servers()
+    procs = start_servers()
 
     try:
         # Test 1: Cache performance
         cache_results = test_cache_performance()
 
         # Test 2: Throughput
-        throughput_results = test_throughput()
+        throughput_results = test_throughput(args.distribution)
 
         # Final summary
         print("\n" + "=" * 70)
@@ -213,12 +332,13 @@ def main():
 DNS System Performance Metrics:
 
   1. Query Processing:
-     - Total queries processed: {throughput_results['total_queries']}
+     - Total queries processed: {throughput_results['total_queries']} ({throughput_results['distribution']} distribution)
      - Successful queries:      {throughput_results['successful']} ({throughput_results['successful']/throughput_results['total_queries']*100:.1f}%)
      - Throughput:              {throughput_results['qps']:.0f} queries/second
 
   2. Cache Performance:
      - Cache hit rate:          {cache_results['cache_hit_rate']:.1f}%
+     - Working set / cache:     {cache_results['working_set_ratio']:.3f}
      - Latency reduction:       {cache_results['cache_improvement_pct']:.1f}% faster with caching
      - Cached query latency:    {cache_results['avg_cached_query_ms']:.2f} ms
      - Full resolution latency: {cache_results['avg_first_query_ms']:.2f} ms
@@ -226,18 +346,19 @@ DNS System Performance Metrics:
   3. Latency (P95):
      - 95th percentile:         {throughput_results['p95_latency_ms']:.2f} ms
      - Average:                 {throughput_results['avg_latency_ms']:.2f} ms
+     - Cold first query:        {cache_results['warmup_ms']:.2f} ms (excluded from the above)
 
 Architecture:
   - Components: 6 (Client, Local Server, Root, 2x TLD, Authoritative)
   - Protocol: TCP/IP sockets
-  - Cache: LRU with TTL (300s, max 1000 entries)
+  - Cache: LRU with TTL ({cache_results['cache_ttl']}s, max {cache_results['cache_max_size']} entries)
   - Records loaded: {len(load_test_domains())} domains
 """)
 
     finally:
         # Clean up
         print("\nStopping servers...")
-        stop_servers()
+        stop_servers(procs)
         print("Done!")
 
 if __name__ == "__main__":
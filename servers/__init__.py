@@ -0,0 +1 @@
+"""Root, TLD, authoritative and local DNS servers, run as python3 -m servers.<name>."""
@@ -0,0 +1,136 @@
+"""Shared asyncio serving loop for the Root and TLD servers.
+
+AsyncDNSServer owns the listening sockets, the optional worker processes
+and one event loop per process; subclasses only turn a query into a
+serialized response by implementing handle_query().
+"""
+
+import asyncio
+import itertools
+import logging
+import os
+import signal
+import socket
+
+from dns_protocol import DNSMessage, read_message
+from dns_logging import setup_logging, stop_logging
+from .listeners import fork_workers, open_listeners, open_unix_listener, stop_workers
+
+
+def _interrupt(signum, frame):
+    """Turn SIGTERM into the KeyboardInterrupt shutdown path."""
+    raise KeyboardInterrupt
+
+
+class AsyncDNSServer:
+    """Base class for servers that answer each query with one response.
+
+    Attributes:
+        name: Log tag without brackets, e.g. "ROOT" or "TLD-COM".
+        host: Server bind address.
+        port: Server bind port.
+        socks: Listening TCP sockets sharing the server port.
+        unix_path: Path of an additional Unix socket listener, or None.
+            Colocated clients can use it to bypass the loopback TCP stack.
+        unix_sock: Listening Unix socket, once started with unix_path.
+        workers: Number of serving processes sharing the listeners.
+        query_count: Total queries processed by this process, brought up
+            to date at shutdown.
+        logger: Logger named after the tag; records are written by the
+            background writer from dns_logging.
+    """
+
+    def __init__(self, name, host, port, workers=1, unix_path=None):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.socks = []
+        self.unix_path = unix_path if hasattr(socket, 'AF_UNIX') else None
+        self.unix_sock = None
+        self.workers = workers
+        self.query_count = 0
+        # next() yields the 1-based number of each query in one C call
+        self._query_counter = itertools.count(1)
+        self.logger = logging.getLogger(name)
+
+    def handle_query(self, query_id, domain):
+        """Process a query.
+
+        Args:
+            query_id: Identifier of the query.
+            domain: UTF-8-encoded domain name, as carried on the wire.
+
+        Returns:
+            Serialized response bytes, including the length prefix.
+        """
+        raise NotImplementedError
+
+    def describe(self):
+        """Return extra lines printed after the startup banner."""
+        return []
+
+    async def handle_client(self, reader, writer):
+        """Serve length-prefixed queries on a connection until the peer closes it.
+
+        Args:
+            reader: StreamReader of the accepted connection.
+            writer: StreamWriter of the accepted connection.
+        """
+        try:
+            while True:
+                data = await read_message(reader)
+                if data is None:
+                    break
+                writer.write(self.handle_query(*DNSMessage.deserialize_query_fields(data)))
+                await writer.drain()
+        except asyncio.CancelledError:
+            # Server shutdown; returning quietly avoids a logged traceback
+            # for every open connection
+            pass
+        except Exception as e:
+            self.logger.error("Error: %s", e)
+        finally:
+            writer.close()
+
+    async def serve(self):
+        """Accept and serve connections on every listening socket forever."""
+        servers = [await asyncio.start_server(self.handle_client, sock=sock)
+                   for sock in self.socks]
+        if self.unix_sock is not None:
+            servers.append(await asyncio.start_unix_server(self.handle_client, sock=self.unix_sock))
+        await asyncio.gather(*(server.serve_forever() for server in servers))
+
+    def start(self):
+        """Bind the listeners, fork workers and serve until interrupted."""
+        self.socks = open_listeners(self.host, self.port)
+        print(f"[{self.name}] Server started on {self.host}:{self.port} ({self.workers} worker(s))")
+        if self.unix_path:
+            self.unix_sock = open_unix_listener(self.unix_path)
+            print(f"[{self.name}] Unix socket: {self.unix_path}")
+        for line in self.describe():
+            print(f"[{self.name}] {line}")
+        parent = os.getpid()
+        workers, self.socks = fork_workers(self.workers, self.socks)
+        # Replaces fork_workers' forwarding handler: the shutdown path below
+        # stops the workers itself and then removes the Unix socket
+        signal.signal(signal.SIGTERM, _interrupt)
+        setup_logging()
+
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            stop_workers(workers)
+            stop_logging()
+            self.query_count = next(self._query_counter) - 1
+            print(f"\n[{self.name}] Shutting down... Processed {self.query_count} queries")
+        finally:
+            for sock in self.socks:
+                sock.close()
+            if self.unix_sock is not None:
+                self.unix_sock.close()
+                # Workers share the parent's socket file; only the parent removes it
+                if os.getpid() == parent:
+                    try:
+                        os.unlink(self.unix_path)
+                    except FileNotFoundError:
+                        pass
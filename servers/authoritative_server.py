@@ -4,12 +4,18 @@
 Loads domain to IP mappings and returns final IP addresses for queries.
 """
 
-import socket
-import sys
-import os
+import itertools
+import logging
+import pathlib
 
-sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from dns_protocol import DNSMessage
+from dns_protocol import DNSMessage, recv_message, send_parts, RECV_BUFFER_SIZE
+from dns_logging import setup_logging, stop_logging
+from .listeners import fork_workers, open_listeners, serve, stop_workers
+
+logger = logging.getLogger("AUTH")
+
+# Repository root; records_file paths are relative to it
+BASE_DIR = pathlib.Path(__file__).resolve().parent.parent
 
 
 class AuthoritativeServer:
@@ -19,40 +25,45 @@ class AuthoritativeServer:
         host: Server bind address.
         port: Server bind port.
         records_file: Path to DNS records file.
-        sock: TCP socket for accepting connections.
+        socks: Listening TCP sockets sharing the server port.
         dns_records: Domain to IP mapping loaded from file.
-        query_count: Total queries processed.
+        workers: Number of serving processes sharing the listeners.
+        query_count: Total queries processed, brought up to date at
+            shutdown.
     """
 
-    def __init__(self, host='127.0.0.1', port=53003, records_file='data/dns_records.txt'):
+    def __init__(self, host='127.0.0.1', port=53003, records_file='data/dns_records.txt', workers=1):
         self.host = host
         self.port = port
         self.records_file = records_file
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socks = []
 
         self.dns_records = {}
         self.load_dns_records()
 
+        # Answers keyed and valued as they appear on the wire, so a query is
+        # answered without decoding its domain or encoding the IP
+        self._answers = {domain.encode('utf-8'): ip.encode('utf-8')
+                         for domain, ip in self.dns_records.items()}
+        self._not_found = b"Domain not found"
+
+        self.workers = workers
         self.query_count = 0
+        # next() is atomic under the GIL, so connection threads can share it
+        self._query_counter = itertools.count(1)
 
     def load_dns_records(self):
         """Load DNS records from text file."""
-        base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        records_path = os.path.join(base_dir, self.records_file)
+        records_path = BASE_DIR / self.records_file
 
         try:
             with open(records_path, 'r') as f:
-                for line in f:
-                    line = line.strip()
-                    if line.startswith('#') or not line:
-                        continue
+                lines = f.read().splitlines()
 
-                    parts = line.split(',')
-                    if len(parts) == 2:
-                        domain = parts[0].strip().lower()
-                        ip = parts[1].strip()
-                        self.dns_records[domain] = ip
+            # One pass over the file: skip blanks and comments, keep "domain,ip" rows
+            rows = (line.split(',') for line in map(str.strip, lines) if line and line[0] != '#')
+            self.dns_records.update({parts[0].strip().lower(): parts[1].strip()
+                                     for parts in rows if len(parts) == 2})
 
             print(f"[AUTH] Loaded {len(self.dns_records)} DNS records from {records_path}")
         except FileNotFoundError:
@@ -62,67 +73,72 @@ class AuthoritativeServer:
             print(f"[AUTH] ERROR loading records: {e}")
             print(f"[AUTH] Starting with empty records database")
 
-    def handle_query(self, query_msg):
+    def handle_query(self, query_id, domain):
         """Process DNS query and return IP address.
 
         Args:
-            query_msg: DNSMessage query object.
+            query_id: Identifier of the query.
+            domain: UTF-8-encoded domain name.
 
         Returns:
-            DNSMessage response with IP or ERROR type.
+            Response with IP or ERROR type as (header, domain, value)
+            buffers for send_parts.
+        """
+        count = next(self._query_counter)
+
+        ip_address = self._answers.get(domain if domain.islower() else domain.lower())
+        if ip_address is not None:
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("Query #%d: %s -> %s", count, domain.decode(), ip_address.decode())
+            return DNSMessage.serialize_response_parts(query_id, domain, b'I', ip_address)
+
+        logger.info("Query #%d: %s -> NOT FOUND", count, domain.decode())
+        return DNSMessage.serialize_response_parts(query_id, domain, b'E', self._not_found)
+
+    def handle_connection(self, conn):
+        """Serve length-prefixed queries on a connection until the peer closes it.
+
+        Args:
+            conn: Accepted client socket.
         """
-        self.query_count += 1
-
-        domain = query_msg.domain.lower()
-
-        if domain in self.dns_records:
-            ip_address = self.dns_records[domain]
-            response = DNSMessage(
-                msg_type="RESPONSE",
-                query_id=query_msg.query_id,
-                domain=query_msg.domain,
-                result_type="IP",
-                result_value=ip_address
-            )
-            print(f"[AUTH] Query #{self.query_count}: {query_msg.domain} -> {ip_address}")
-        else:
-            response = DNSMessage(
-                msg_type="RESPONSE",
-                query_id=query_msg.query_id,
-                domain=query_msg.domain,
-                result_type="ERROR",
-                result_value="Domain not found"
-            )
-            print(f"[AUTH] Query #{self.query_count}: {query_msg.domain} -> NOT FOUND")
-
-        return response
+        rx = memoryview(bytearray(RECV_BUFFER_SIZE))
+        try:
+            while True:
+                data = recv_message(conn, rx)
+                if data is None:
+                    break
+                send_parts(conn, self.handle_query(*DNSMessage.deserialize_query_fields(data)))
+        except Exception as e:
+            logger.error("Error: %s", e)
+        finally:
+            conn.close()
 
     def start(self):
         """Start the authoritative server and handle incoming connections."""
-        self.sock.bind((self.host, self.port))
-        self.sock.listen(5)
-        print(f"[AUTH] Server started on {self.host}:{self.port}")
+        self.socks = open_listeners(self.host, self.port)
+        print(f"[AUTH] Server started on {self.host}:{self.port} ({self.workers} worker(s))")
+        workers, self.socks = fork_workers(self.workers, self.socks)
+        setup_logging()
 
-        while True:
-            try:
-                conn, addr = self.sock.accept()
-                data = conn.recv(1024)
+        try:
+            serve(self.socks, self.handle_connection, "[AUTH]")
+        except KeyboardInterrupt:
+            stop_workers(workers)
+            stop_logging()
+            self.query_count = next(self._query_counter) - 1
+            print(f"\n[AUTH] Shutting down... Processed {self.query_count} queries")
 
-                if data:
-                    query = DNSMessage.deserialize(data)
-                    response = self.handle_query(query)
-                    conn.sendall(response.serialize())
+        for sock in self.socks:
+            sock.close()
 
-                conn.close()
-            except KeyboardInterrupt:
-                print(f"\n[AUTH] Shutting down... Processed {self.query_count} queries")
-                break
-            except Exception as e:
-                print(f"[AUTH] Error: {e}")
 
-        self.sock.close()
+if __name__ == "__main__":
+    import argparse
 
+    parser = argparse.ArgumentParser(description='Authoritative DNS Server')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of server processes sharing the port')
+    args = parser.parse_args()
 
-if __name__ == "__main__":
-    server = AuthoritativeServer()
+    server = AuthoritativeServer(workers=args.workers)
     server.start()
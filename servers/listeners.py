@@ -0,0 +1,265 @@
+"""Shared TCP listening sockets and accept loops for the DNS servers.
+
+Each server binds several listening sockets to the same address with
+SO_REUSEPORT and accepts on one thread per socket; the kernel spreads
+incoming connections across the group, so accepts scale past a single
+thread without any user-space locking. Platforms without SO_REUSEPORT get
+a single listener.
+
+fork_workers() extends this across processes: each forked worker keeps its
+own share of the bound listeners and closes the rest, so CPU-bound query
+handling is not limited to one core by the GIL and a new connection wakes
+only the process that owns its socket.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import signal
+import socket
+import stat
+import sys
+import tempfile
+import threading
+
+# prctl(2) option asking the kernel to signal a process when its parent dies
+PR_SET_PDEATHSIG = 1
+
+# Pending-connection queue per listener; small backlogs drop SYNs under
+# bursts. The kernel caps it at net.core.somaxconn.
+LISTEN_BACKLOG = 1024
+
+
+def open_listeners(host, port, count=None, backlog=LISTEN_BACKLOG):
+    """Bind TCP listening sockets sharing (host, port).
+
+    Args:
+        host: Bind address.
+        port: Bind port.
+        count: Number of sockets; defaults to the CPU count. Forced to 1
+            when SO_REUSEPORT is unavailable.
+        backlog: listen() backlog for each socket.
+
+    Returns:
+        List of listening sockets.
+    """
+    reuseport = hasattr(socket, 'SO_REUSEPORT')
+    if not reuseport:
+        count = 1
+    elif count is None:
+        count = os.cpu_count() or 1
+
+    socks = []
+    for _ in range(count):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuseport:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind((host, port))
+        sock.listen(backlog)
+        socks.append(sock)
+    return socks
+
+
+def runtime_dir():
+    """Return a directory for Unix sockets that only the current user can use.
+
+    This is a dns-resolver directory under $XDG_RUNTIME_DIR when that is
+    set, otherwise a per-user directory in the system temp directory. It is
+    created with mode 0700 if missing.
+
+    Returns:
+        Directory path.
+
+    Raises:
+        PermissionError: If the directory is not a directory owned by the
+            current user, or other users can access it.
+    """
+    base = os.environ.get('XDG_RUNTIME_DIR')
+    if base:
+        path = os.path.join(base, 'dns-resolver')
+    else:
+        path = os.path.join(tempfile.gettempdir(), f'dns-resolver-{os.getuid()}')
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise PermissionError(f"Unsafe runtime directory: {path}")
+    return path
+
+
+def open_unix_listener(path, backlog=LISTEN_BACKLOG):
+    """Bind a Unix stream listening socket at path.
+
+    A socket file left behind by a server that is no longer running is
+    replaced; one that still accepts connections is left alone.
+
+    Args:
+        path: Filesystem path for the socket.
+        backlog: listen() backlog.
+
+    Returns:
+        Listening AF_UNIX socket.
+
+    Raises:
+        OSError: If another server is listening at path, or path exists
+            and is not a socket.
+    """
+    try:
+        mode = os.lstat(path).st_mode
+    except FileNotFoundError:
+        mode = None
+    if mode is not None and stat.S_ISSOCK(mode):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+        except ConnectionRefusedError:
+            os.unlink(path)
+        else:
+            raise OSError(errno.EADDRINUSE, f"Another server is listening on {path}")
+        finally:
+            probe.close()
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    sock.listen(backlog)
+    return sock
+
+
+def accept_loop(sock, handle_connection, tag):
+    """Accept connections on sock and serve each on its own thread.
+
+    Accepted sockets have Nagle's algorithm disabled so each response
+    leaves as soon as it is written. Returns once sock has been closed.
+
+    Args:
+        sock: Listening socket.
+        handle_connection: Callable taking the accepted socket.
+        tag: Log prefix such as "[ROOT]".
+    """
+    while True:
+        try:
+            conn, _ = sock.accept()
+        except OSError as e:
+            if sock.fileno() == -1:
+                return
+            print(f"{tag} Error: {e}")
+            continue
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        threading.Thread(target=handle_connection, args=(conn,), daemon=True).start()
+
+
+def serve(socks, handle_connection, tag):
+    """Run one accept loop per listening socket until interrupted.
+
+    The first socket is served on the calling thread so KeyboardInterrupt
+    reaches the caller; the rest get daemon threads.
+
+    Args:
+        socks: Listening sockets from open_listeners.
+        handle_connection: Callable taking an accepted socket.
+        tag: Log prefix such as "[ROOT]".
+    """
+    for sock in socks[1:]:
+        threading.Thread(target=accept_loop, args=(sock, handle_connection, tag),
+                         daemon=True).start()
+    accept_loop(socks[0], handle_connection, tag)
+
+
+def fork_workers(count, socks):
+    """Fork count - 1 worker processes and split the listeners between them.
+
+    Call after open_listeners and before starting any threads. Process i
+    (the parent is 0) keeps socks[i::count] and closes the others, so each
+    SO_REUSEPORT socket is served by exactly one process and an incoming
+    connection does not wake every process. With fewer sockets than
+    processes, process i shares socks[i % len(socks)] with the others.
+
+    In the parent, SIGTERM is forwarded to the workers before the parent
+    itself exits, so stopping the parent stops the whole group; on Linux
+    each worker is also sent SIGTERM if the parent dies without cleaning
+    up, e.g. from SIGKILL. Platforms without os.fork run a single process
+    with every socket.
+
+    Args:
+        count: Total number of serving processes, including the parent.
+        socks: Listening sockets from open_listeners.
+
+    Returns:
+        Tuple (children, socks): worker PIDs in the parent (an empty list
+        in each worker) and the listeners this process should serve.
+    """
+    if not hasattr(os, 'fork') or count <= 1:
+        return [], socks
+
+    # Unflushed output would otherwise be written once per process
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    index = 0
+    children = []
+    parent = os.getpid()
+    for i in range(1, count):
+        pid = os.fork()
+        if pid == 0:
+            index = i
+            children = []
+            _die_with_parent(parent)
+            break
+        children.append(pid)
+
+    if len(socks) >= count:
+        own = socks[index::count]
+    else:
+        own = [socks[index % len(socks)]]
+    for sock in socks:
+        if sock not in own:
+            sock.close()
+
+    if children:
+        def forward(signum, frame):
+            stop_workers(children)
+            signal.signal(signum, signal.SIG_DFL)
+            os.kill(os.getpid(), signum)
+
+        signal.signal(signal.SIGTERM, forward)
+    return children, own
+
+
+def _die_with_parent(parent):
+    """Make the calling worker receive SIGTERM when its parent process dies.
+
+    Uses prctl(PR_SET_PDEATHSIG) on Linux so a parent killed with SIGKILL
+    does not leave workers holding the listening port. Elsewhere this is a
+    no-op and workers are only stopped through the parent.
+
+    Args:
+        parent: PID of the parent that forked the worker.
+    """
+    if not sys.platform.startswith('linux'):
+        return
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.prctl(PR_SET_PDEATHSIG, signal.SIGTERM, 0, 0, 0)
+    except (OSError, AttributeError):
+        return
+    # The parent may have died before prctl took effect
+    if os.getppid() != parent:
+        os._exit(0)
+
+
+def stop_workers(children):
+    """Terminate forked workers and wait for them to exit.
+
+    Args:
+        children: PIDs returned by fork_workers.
+    """
+    for pid in children:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    for pid in children:
+        try:
+            os.waitpid(pid, 0)
+        except ChildProcessError:
+            pass
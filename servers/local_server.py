@@ -3,25 +3,57 @@
 
 Performs iterative DNS resolution by querying root, TLD, and authoritative
 servers in sequence. Results are cached with TTL and LRU eviction.
+
+Clients can query over TCP (length-prefixed, persistent connections) or
+UDP (one message body per datagram, no length prefix).
 """
 
+import json
+import logging
 import socket
-import sys
+import selectors
 import os
+import threading
 import time
-from collections import OrderedDict
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from dns_protocol import (DNSMessage, MessagePool, recv_message, RECV_BUFFER_SIZE,
+                          LENGTH_PREFIX_SIZE, STATS_DOMAIN)
+from dns_logging import setup_logging, stop_logging
+from .listeners import LISTEN_BACKLOG
+from .root_server import root_unix_path
+from .udp_batch import DatagramBatcher
+
+logger = logging.getLogger("LOCAL")
+
+# Largest UDP query accepted, as in classic DNS
+UDP_MAX_SIZE = 512
+
+# Idle connections kept per upstream server; extras are closed after use
+MAX_IDLE_UPSTREAM = 32
 
-sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from dns_protocol import DNSMessage
+# Hosts for which the root server is assumed to be on this machine
+LOOPBACK_HOSTS = ('127.0.0.1', 'localhost', '::1')
+
+# Seconds between sweeps of expired cache entries
+CACHE_SWEEP_INTERVAL = 1.0
 
 
 class DNSCache:
     """LRU cache with TTL for DNS records.
 
+    Lookups never read the clock: expired entries are removed by sweep(),
+    which the server calls about once a second, so an entry can outlive its
+    TTL by at most one sweep interval. All operations are serialized by a
+    lock because connection threads and UDP workers share the cache.
+
     Attributes:
-        cache: OrderedDict mapping domains to (ip, timestamp) tuples.
+        cache: OrderedDict mapping domains to (ip, expires_at) tuples, where
+            expires_at is a time.monotonic_ns() deadline.
         max_size: Maximum cache entries before LRU eviction.
         ttl: Time-to-live in seconds for cache entries.
+        ttl_ns: ttl in nanoseconds.
         hits: Total cache hits.
         misses: Total cache misses.
     """
@@ -30,35 +62,67 @@ class DNSCache:
         self.cache = OrderedDict()
         self.max_size = max_size
         self.ttl = ttl
+        self.ttl_ns = ttl * 1_000_000_000
         self.hits = 0
         self.misses = 0
+        # (expires_at, domain) in insertion order; with one TTL for all
+        # entries this is also deadline order
+        self._expiry = deque()
+        self._lock = threading.Lock()
 
     def get(self, domain):
-        """Retrieve from cache if exists and not expired.
+        """Retrieve from cache if present.
 
         Returns:
-            Cached IP address or None if miss or expired.
+            Cached IP address or None on a miss.
         """
-        if domain in self.cache:
-            ip, timestamp = self.cache[domain]
-            if time.time() - timestamp < self.ttl:
+        with self._lock:
+            entry = self.cache.get(domain)
+            if entry is not None:
                 self.cache.move_to_end(domain)
                 self.hits += 1
-                return ip
-            else:
-                del self.cache[domain]
+                return entry[0]
+            self.misses += 1
+            return None
+
+    def put(self, domain, ip, now=None):
+        """Add to cache, evicting LRU entry if at capacity.
+
+        Args:
+            domain: Domain name.
+            ip: Resolved IP address.
+            now: Current time.monotonic_ns(), if the caller already has it.
+        """
+        if now is None:
+            now = time.monotonic_ns()
+        expires_at = now + self.ttl_ns
+        with self._lock:
+            if domain in self.cache:
+                self.cache.move_to_end(domain)
+            elif len(self.cache) >= self.max_size:
+                self.cache.popitem(last=False)
 
-        self.misses += 1
-        return None
+            self.cache[domain] = (ip, expires_at)
+            self._expiry.append((expires_at, domain))
 
-    def put(self, domain, ip):
-        """Add to cache, evicting LRU entry if at capacity."""
-        if domain in self.cache:
-            self.cache.move_to_end(domain)
-        elif len(self.cache) >= self.max_size:
-            self.cache.popitem(last=False)
+    def sweep(self, now=None):
+        """Remove entries whose TTL has passed.
 
-        self.cache[domain] = (ip, time.time())
+        Only the expired head of the deadline queue is examined. Queue
+        items left behind by re-inserted or evicted domains are skipped.
+
+        Args:
+            now: Current time.monotonic_ns(), if the caller already has it.
+        """
+        if now is None:
+            now = time.monotonic_ns()
+        expiry = self._expiry
+        with self._lock:
+            while expiry and expiry[0][0] <= now:
+                expires_at, domain = expiry.popleft()
+                entry = self.cache.get(domain)
+                if entry is not None and entry[1] == expires_at:
+                    del self.cache[domain]
 
     def get_hit_rate(self):
         """Calculate cache hit rate as percentage."""
@@ -75,48 +139,159 @@ class LocalServer:
         host: Server bind address.
         port: Server bind port.
         root_server: (host, port) tuple for root DNS server.
+        root_unix_path: Unix socket of a colocated root server, tried before
+            TCP when it exists; None unless enabled with use_unix and the
+            root server is on a loopback address.
         sock: TCP socket for accepting connections.
+        udp_sock: UDP socket for datagram queries.
+        udp_batch: DatagramBatcher moving UDP traffic in batches.
+        executor: Worker pool that resolves UDP queries.
+        upstream_pool: Mapping of upstream (host, port) to a deque of idle
+            connected sockets shared by all threads.
         cache: DNS cache instance.
+        tld_cache: Mapping of TLD to (host, port) of its TLD server.
+        auth_cache: Mapping of second-level zone to (host, port) of its
+            authoritative server.
         query_count: Total queries processed.
         total_resolution_time: Cumulative resolution time in milliseconds.
+            Both counters are updated by connection threads and UDP
+            workers concurrently, under a lock.
     """
 
     def __init__(self, host='127.0.0.1', port=53004,
-                 root_server=('127.0.0.1', 53000)):
+                 root_server=('127.0.0.1', 53000), use_unix=False):
         self.host = host
         self.port = port
         self.root_server = root_server
+        colocated = root_server[0] in LOOPBACK_HOSTS and hasattr(socket, 'AF_UNIX')
+        self.root_unix_path = root_unix_path(root_server[1]) if use_unix and colocated else None
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp_batch = DatagramBatcher(self.udp_sock, size=32, bufsize=UDP_MAX_SIZE)
+        self.executor = ThreadPoolExecutor(max_workers=os.cpu_count())
+        # Replies from executor workers, flushed by the selector thread
+        self._outbox = []
+        self._outbox_lock = threading.Lock()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._local = threading.local()
+        self.upstream_pool = defaultdict(deque)
 
         self.cache = DNSCache(max_size=1000, ttl=300)
+        self.tld_cache = {}
+        self._ns_parse_cache = {}
+        self.auth_cache = {}
 
+        self._msg_pool = MessagePool()
         self.query_count = 0
         self.total_resolution_time = 0.0
+        self._stats_lock = threading.Lock()
+
+    def close_upstream_conns(self):
+        """Close every idle pooled upstream connection."""
+        for pool in self.upstream_pool.values():
+            while pool:
+                pool.pop().close()
+
+    @property
+    def upstream_rx(self):
+        """Reusable receive buffer for the calling thread's upstream replies."""
+        try:
+            return self._local.upstream_rx
+        except AttributeError:
+            self._local.upstream_rx = memoryview(bytearray(RECV_BUFFER_SIZE))
+            return self._local.upstream_rx
+
+    def connect_upstream(self, server_addr):
+        """Open a connection to an upstream server.
 
-    def query_server(self, server_addr, query_msg):
+        The root server is reached over its Unix socket when root_unix_path
+        exists and accepts the connection; everything else uses TCP.
+
+        Args:
+            server_addr: (host, port) tuple for target server.
+
+        Returns:
+            Connected stream socket.
+        """
+        if server_addr == self.root_server and self.root_unix_path:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.root_unix_path)
+                return sock
+            except OSError:
+                sock.close()
+
+        sock = socket.create_connection(server_addr)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def query_server(self, server_addr, query):
         """Send query to DNS server and receive response.
 
+        The query goes over an idle pooled connection to server_addr, or a
+        new one if none is idle, and the connection is returned to the pool
+        afterwards. If a reused connection turns out to be dead (the server
+        restarted or dropped it), it is discarded and the query is retried
+        once on a fresh connection.
+
         Args:
             server_addr: (host, port) tuple for target server.
-            query_msg: DNSMessage query to send.
+            query: Serialized query bytes, as from DNSMessage.serialize_query.
 
         Returns:
-            DNSMessage response or None on error.
+            Tuple (result_code, value) with result_code b'I', b'N' or b'E'
+            and value the undecoded result value, or None on error.
         """
-        try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.connect(server_addr)
-            sock.sendall(query_msg.serialize())
-            data = sock.recv(1024)
-            sock.close()
-
-            if data:
-                return DNSMessage.deserialize(data)
-        except Exception as e:
-            print(f"[LOCAL] Error querying {server_addr}: {e}")
+        pool = self.upstream_pool[server_addr]
+        rx = self.upstream_rx
+
+        while True:
+            try:
+                sock = pool.pop()
+                reused = True
+            except IndexError:
+                sock = None
+                reused = False
+            try:
+                if sock is None:
+                    sock = self.connect_upstream(server_addr)
+                sock.sendall(query)
+                data = recv_message(sock, rx)
+                if data is None:
+                    raise ConnectionError("Connection closed by server")
+                _, _, code, value = DNSMessage.deserialize_response_fields(data)
+                # Only a connection that produced a valid response is reused
+                if len(pool) < MAX_IDLE_UPSTREAM:
+                    pool.append(sock)
+                else:
+                    sock.close()
+                return code, value
+            except Exception as e:
+                if sock is not None:
+                    sock.close()
+                if not reused:
+                    logger.error("Error querying %s: %s", server_addr, e)
+                    return None
+
+    def parse_referral(self, value):
+        """Parse an NS referral of the form "KIND:host:port".
+
+        Upstream servers return a handful of distinct referral values, so
+        parsed addresses are memoised per value and only a new one is
+        decoded.
+
+        Args:
+            value: Undecoded referral value from the response.
 
-        return None
+        Returns:
+            (host, port) tuple.
+        """
+        addr = self._ns_parse_cache.get(value)
+        if addr is None:
+            rest, _, port = value.decode().rpartition(':')
+            addr = self._ns_parse_cache[value] = (rest.partition(':')[2], int(port))
+        return addr
 
     def iterative_resolve(self, domain, query_id):
         """Perform iterative DNS resolution through hierarchy.
@@ -124,6 +299,11 @@ class LocalServer:
         Queries root server for TLD, TLD server for authoritative, and
         authoritative server for final IP.
 
+        NS referrals are remembered in tld_cache (per TLD) and auth_cache
+        (per second-level zone), so later queries skip the root, or the
+        root and TLD, hops. A cached server that cannot be reached is
+        forgotten and the next query re-resolves from the root.
+
         Args:
             domain: Domain name to resolve.
             query_id: Query identifier.
@@ -131,107 +311,129 @@ class LocalServer:
         Returns:
             IP address string or None if resolution fails.
         """
-        print(f"[LOCAL] Starting iterative resolution for {domain}")
+        logger.info("Starting iterative resolution for %s", domain)
 
-        query = DNSMessage("QUERY", query_id, domain)
-        response = self.query_server(self.root_server, query)
+        # Serialized once and sent unchanged to every hop
+        query = DNSMessage.serialize_query(query_id, domain)
+        tld = domain.rpartition('.')[2]
+        zone = '.'.join(domain.rsplit('.', 2)[-2:])
 
-        if not response or response.result_type == "ERROR":
-            print(f"[LOCAL] Root server error")
-            return None
+        auth_server = self.auth_cache.get(zone)
+        tld_server = None if auth_server else self.tld_cache.get(tld)
 
-        if response.result_type != "NS":
-            print(f"[LOCAL] Unexpected response from root: {response.result_type}")
-            return None
+        if auth_server is None and tld_server is None:
+            response = self.query_server(self.root_server, query)
 
-        parts = response.result_value.split(':')
-        tld_server = (parts[1], int(parts[2]))
-        print(f"[LOCAL] Root -> TLD server at {tld_server[0]}:{tld_server[1]}")
+            if not response or response[0] == b'E':
+                logger.info("Root server error")
+                return None
 
-        response = self.query_server(tld_server, query)
+            code, value = response
+            if code != b'N':
+                logger.info("Unexpected response from root: %s", code.decode())
+                return None
 
-        if not response or response.result_type == "ERROR":
-            print(f"[LOCAL] TLD server error")
-            return None
+            tld_server = self.parse_referral(value)
+            self.tld_cache[tld] = tld_server
+            logger.info("Root -> TLD server at %s:%d", *tld_server)
 
-        if response.result_type != "NS":
-            if response.result_type == "IP":
-                return response.result_value
-            print(f"[LOCAL] Unexpected response from TLD: {response.result_type}")
-            return None
+        if auth_server is None:
+            response = self.query_server(tld_server, query)
+
+            if not response or response[0] == b'E':
+                if not response:
+                    self.tld_cache.pop(tld, None)
+                logger.info("TLD server error")
+                return None
+
+            code, value = response
+            if code != b'N':
+                if code == b'I':
+                    return value.decode()
+                logger.info("Unexpected response from TLD: %s", code.decode())
+                return None
 
-        parts = response.result_value.split(':')
-        auth_server = (parts[1], int(parts[2]))
-        print(f"[LOCAL] TLD -> Auth server at {auth_server[0]}:{auth_server[1]}")
+            auth_server = self.parse_referral(value)
+            self.auth_cache[zone] = auth_server
+            logger.info("TLD -> Auth server at %s:%d", *auth_server)
 
         response = self.query_server(auth_server, query)
 
         if not response:
-            print(f"[LOCAL] Auth server error")
+            self.auth_cache.pop(zone, None)
+            logger.info("Auth server error")
             return None
 
-        if response.result_type == "IP":
-            print(f"[LOCAL] Auth -> IP: {response.result_value}")
-            return response.result_value
+        code, value = response
+        if code == b'I':
+            ip_address = value.decode()
+            logger.info("Auth -> IP: %s", ip_address)
+            return ip_address
         else:
-            print(f"[LOCAL] Auth server returned: {response.result_type}")
+            logger.info("Auth server returned: %s", code.decode())
             return None
 
     def handle_query(self, query_msg):
         """Process DNS query with caching.
 
+        A query for STATS_DOMAIN is answered with the server counters as
+        JSON instead of being resolved; it is not counted or cached.
+
         Args:
             query_msg: DNSMessage query object.
 
         Returns:
-            DNSMessage response with IP or ERROR type.
+            DNSMessage response with IP, ERROR or STATS type.
         """
-        self.query_count += 1
-        start_time = time.time()
-
-        domain = query_msg.domain.lower()
+        if query_msg.domain == STATS_DOMAIN:
+            with self._stats_lock:
+                queries = self.query_count
+            stats = json.dumps({
+                "queries": queries,
+                "hits": self.cache.hits,
+                "misses": self.cache.misses,
+                "cache_size": len(self.cache.cache),
+                "max_size": self.cache.max_size,
+                "ttl": self.cache.ttl,
+            })
+            return self._msg_pool.response(query_msg.query_id, query_msg.domain, "STATS", stats)
+
+        with self._stats_lock:
+            self.query_count += 1
+            count = self.query_count
+        start_time = time.monotonic_ns()
+
+        domain = query_msg.domain
+        if not domain.islower():
+            domain = domain.lower()
 
         cached_ip = self.cache.get(domain)
         if cached_ip:
-            resolution_time = (time.time() - start_time) * 1000
-            self.total_resolution_time += resolution_time
-            print(f"[LOCAL] Query #{self.query_count}: {domain} -> {cached_ip} (CACHED, {resolution_time:.2f}ms)")
-
-            response = DNSMessage(
-                msg_type="RESPONSE",
-                query_id=query_msg.query_id,
-                domain=query_msg.domain,
-                result_type="IP",
-                result_value=cached_ip
-            )
+            resolution_time = (time.monotonic_ns() - start_time) / 1_000_000
+            with self._stats_lock:
+                self.total_resolution_time += resolution_time
+            logger.info("Query #%d: %s -> %s (CACHED, %.2fms)",
+                        count, domain, cached_ip, resolution_time)
+
+            response = self._msg_pool.response(query_msg.query_id, query_msg.domain, "IP", cached_ip)
             return response
 
-        print(f"[LOCAL] Query #{self.query_count}: {domain} (CACHE MISS)")
+        logger.info("Query #%d: %s (CACHE MISS)", count, domain)
         ip_address = self.iterative_resolve(domain, query_msg.query_id)
 
-        resolution_time = (time.time() - start_time) * 1000
-        self.total_resolution_time += resolution_time
+        end_time = time.monotonic_ns()
+        resolution_time = (end_time - start_time) / 1_000_000
+        with self._stats_lock:
+            self.total_resolution_time += resolution_time
 
         if ip_address:
-            self.cache.put(domain, ip_address)
-            print(f"[LOCAL] Resolved {domain} -> {ip_address} ({resolution_time:.2f}ms)")
-
-            response = DNSMessage(
-                msg_type="RESPONSE",
-                query_id=query_msg.query_id,
-                domain=query_msg.domain,
-                result_type="IP",
-                result_value=ip_address
-            )
+            self.cache.put(domain, ip_address, end_time)
+            logger.info("Resolved %s -> %s (%.2fms)", domain, ip_address, resolution_time)
+
+            response = self._msg_pool.response(query_msg.query_id, query_msg.domain, "IP", ip_address)
         else:
-            print(f"[LOCAL] Failed to resolve {domain}")
-            response = DNSMessage(
-                msg_type="RESPONSE",
-                query_id=query_msg.query_id,
-                domain=query_msg.domain,
-                result_type="ERROR",
-                result_value="Resolution failed"
-            )
+            logger.info("Failed to resolve %s", domain)
+            response = self._msg_pool.response(query_msg.query_id, query_msg.domain, "ERROR", "Resolution failed")
 
         return response
 
@@ -248,35 +450,144 @@ class LocalServer:
         print(f"[LOCAL] Cache Size: {len(self.cache.cache)}/{self.cache.max_size}")
         print(f"[LOCAL] ========================\n")
 
+    def handle_connection(self, conn):
+        """Serve length-prefixed queries on a connection until the peer closes it.
+
+        Args:
+            conn: Accepted client socket.
+        """
+        rx = memoryview(bytearray(RECV_BUFFER_SIZE))
+        pool = self._msg_pool
+        try:
+            while True:
+                data = recv_message(conn, rx)
+                if data is None:
+                    break
+                query = pool.query(data)
+                response = self.handle_query(query)
+                conn.sendall(response.serialize())
+                pool.release(response)
+                pool.release(query)
+        except Exception as e:
+            logger.error("Error: %s", e)
+        finally:
+            conn.close()
+
+    def handle_datagram(self, data, addr):
+        """Answer one UDP query; runs on an executor worker thread.
+
+        Args:
+            data: Datagram payload (a message body without length prefix).
+            addr: Sender address to reply to.
+        """
+        try:
+            query = self._msg_pool.query(data)
+            response = self.handle_query(query)
+            self.queue_reply(response.serialize()[LENGTH_PREFIX_SIZE:], addr)
+            self._msg_pool.release(response)
+            self._msg_pool.release(query)
+        except Exception as e:
+            logger.error("Error: %s", e)
+
+    def queue_reply(self, payload, addr):
+        """Queue a UDP reply for the selector thread to send.
+
+        The selector thread is woken only when the outbox goes from empty
+        to non-empty, so replies that complete while it is busy are sent
+        together in one batch.
+        """
+        with self._outbox_lock:
+            self._outbox.append((payload, addr))
+            wake = len(self._outbox) == 1
+        if wake:
+            self._wake_w.send(b'\0')
+
+    def flush_replies(self):
+        """Send every queued UDP reply in as few system calls as possible."""
+        try:
+            self._wake_r.recv(4096)
+        except BlockingIOError:
+            pass
+        with self._outbox_lock:
+            replies, self._outbox = self._outbox, []
+        if replies:
+            self.udp_batch.send(replies)
+
+    def accept_connection(self):
+        """Accept a pending TCP client and serve it on its own thread."""
+        conn, addr = self.sock.accept()
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        threading.Thread(target=self.handle_connection, args=(conn,), daemon=True).start()
+
+    def read_datagrams(self):
+        """Drain queued UDP queries, a batch per system call, into the executor."""
+        while True:
+            batch = self.udp_batch.recv()
+            for data, addr in batch:
+                self.executor.submit(self.handle_datagram, data, addr)
+            if len(batch) < self.udp_batch.size:
+                return
+
     def start(self):
-        """Start the local server and handle incoming connections."""
+        """Start the local server and handle incoming connections.
+
+        A single selector (epoll on Linux) watches both the TCP listening
+        socket and the non-blocking UDP socket. UDP traffic is moved in
+        batches with recvmmsg/sendmmsg where available. Expired cache
+        entries are swept from the same loop once per
+        CACHE_SWEEP_INTERVAL.
+        """
         self.sock.bind((self.host, self.port))
-        self.sock.listen(10)
-        print(f"[LOCAL] Server started on {self.host}:{self.port}")
+        self.sock.listen(LISTEN_BACKLOG)
+        self.udp_sock.bind((self.host, self.port))
+        self.udp_sock.setblocking(False)
+        self._wake_r.setblocking(False)
+        setup_logging()
+        print(f"[LOCAL] Server started on {self.host}:{self.port} (TCP and UDP)")
         print(f"[LOCAL] Root server: {self.root_server[0]}:{self.root_server[1]}")
+        if self.root_unix_path:
+            print(f"[LOCAL] Root Unix socket (used when present): {self.root_unix_path}")
         print(f"[LOCAL] Cache: max_size={self.cache.max_size}, TTL={self.cache.ttl}s")
 
+        sel = selectors.DefaultSelector()
+        sel.register(self.sock, selectors.EVENT_READ, self.accept_connection)
+        sel.register(self.udp_sock, selectors.EVENT_READ, self.read_datagrams)
+        sel.register(self._wake_r, selectors.EVENT_READ, self.flush_replies)
+
+        sweep_interval_ns = int(CACHE_SWEEP_INTERVAL * 1_000_000_000)
+        next_sweep = time.monotonic_ns() + sweep_interval_ns
         while True:
             try:
-                conn, addr = self.sock.accept()
-                data = conn.recv(1024)
-
-                if data:
-                    query = DNSMessage.deserialize(data)
-                    response = self.handle_query(query)
-                    conn.sendall(response.serialize())
-
-                conn.close()
+                for key, _ in sel.select(CACHE_SWEEP_INTERVAL):
+                    key.data()
+                now = time.monotonic_ns()
+                if now >= next_sweep:
+                    self.cache.sweep(now)
+                    next_sweep = now + sweep_interval_ns
             except KeyboardInterrupt:
+                stop_logging()
                 self.print_statistics()
                 print(f"[LOCAL] Shutting down...")
                 break
             except Exception as e:
                 print(f"[LOCAL] Error: {e}")
 
+        sel.close()
+        self.executor.shutdown(wait=False)
+        self.close_upstream_conns()
+        self._wake_r.close()
+        self._wake_w.close()
+        self.udp_sock.close()
         self.sock.close()
 
 
 if __name__ == "__main__":
-    server = LocalServer()
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Local DNS Server')
+    parser.add_argument('--use-unix', action='store_true',
+                        help="Reach a colocated root server over its Unix socket (root started with --unix)")
+    args = parser.parse_args()
+
+    server = LocalServer(use_unix=args.use_unix)
     server.start()
@@ -4,30 +4,45 @@
 Receives queries for any domain and returns the appropriate TLD server address.
 """
 
-import socket
-import sys
+import logging
 import os
 
-sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from dns_protocol import DNSMessage
+from .async_server import AsyncDNSServer
+from .listeners import runtime_dir
 
+# Serving processes started by default: one per core, since every process
+# is bound to one core by the GIL
+ROOT_WORKERS = os.cpu_count() or 1
 
-class RootServer:
+
+def root_unix_path(port):
+    """Return the Unix socket path of the root server listening on port.
+
+    The Root Server serves this socket alongside TCP when started with
+    --unix, and a colocated Local Server started with --use-unix connects
+    to it instead of going through the loopback TCP stack. The path lives
+    in the user's private runtime directory and names the port, so servers
+    on different ports never share a socket.
+
+    Args:
+        port: TCP port of the root server.
+
+    Returns:
+        Socket path.
+    """
+    return os.path.join(runtime_dir(), f'root-{port}.sock')
+
+
+class RootServer(AsyncDNSServer):
     """Root DNS server that delegates to TLD servers.
 
     Attributes:
-        host: Server bind address.
-        port: Server bind port.
-        sock: TCP socket for accepting connections.
         tld_servers: Mapping of TLD names to (host, port) tuples.
-        query_count: Total queries processed.
     """
 
-    def __init__(self, host='127.0.0.1', port=53000):
-        self.host = host
-        self.port = port
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    def __init__(self, host='127.0.0.1', port=53000, workers=1, unix_path=None):
+        super().__init__("ROOT", host, port, workers, unix_path)
 
         self.tld_servers = {
             'com': ('127.0.0.1', 53001),
@@ -35,82 +50,81 @@ class RootServer:
             'org': ('127.0.0.1', 53001),
         }
 
-        self.query_count = 0
+        # One responder per TLD, keyed by ".tld" as it appears at the end of
+        # the wire-format domain. Keeping the dot in the key means a domain
+        # without one can never match, so no separate check is needed.
+        self._handlers = {f".{tld}".encode('ascii'): self._referral_handler(tld, tld_host, tld_port)
+                          for tld, (tld_host, tld_port) in self.tld_servers.items()}
 
-    def get_tld(self, domain):
+    @staticmethod
+    def get_tld(domain):
         """Extract TLD from domain name.
 
         Returns:
             TLD string or None if invalid.
         """
-        parts = domain.split('.')
-        if len(parts) >= 2:
-            return parts[-1]
-        return None
+        _, sep, tld = domain.rpartition('.')
+        return tld if sep else None
+
+    def _referral_handler(self, tld, tld_host, tld_port):
+        """Build the responder for one TLD.
+
+        The referral value is encoded once and captured, so a query costs
+        one call that logs and packs the response.
 
-    def handle_query(self, query_msg):
+        Returns:
+            Callable (count, query_id, domain) -> serialized NS response.
+        """
+        referral = f"TLD:{tld_host}:{tld_port}".encode('utf-8')
+        serialize = DNSMessage.serialize_response
+        logger = self.logger
+
+        def respond(count, query_id, domain):
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("Query #%d: %s -> TLD server for .%s at %s:%d",
+                            count, domain.decode(), tld, tld_host, tld_port)
+            return serialize(query_id, domain, b'N', referral)
+
+        return respond
+
+    def _unknown_tld(self, count, query_id, domain):
+        """Respond to a query whose TLD has no server."""
+        name = domain.decode()
+        self.logger.info("Query #%d: %s -> ERROR: Unknown TLD", count, name)
+        return DNSMessage.serialize_response(query_id, domain, b'E',
+                                             f"No TLD server for .{self.get_tld(name)}".encode('utf-8'))
+
+    def handle_query(self, query_id, domain):
         """Process DNS query and return TLD server reference.
 
         Args:
-            query_msg: DNSMessage query object.
+            query_id: Identifier of the query.
+            domain: UTF-8-encoded domain name.
 
         Returns:
-            DNSMessage response with NS or ERROR type.
+            Serialized response bytes with NS or ERROR type.
         """
-        self.query_count += 1
-
-        tld = self.get_tld(query_msg.domain)
-
-        if tld and tld in self.tld_servers:
-            tld_host, tld_port = self.tld_servers[tld]
-            result = f"TLD:{tld_host}:{tld_port}"
-            response = DNSMessage(
-                msg_type="RESPONSE",
-                query_id=query_msg.query_id,
-                domain=query_msg.domain,
-                result_type="NS",
-                result_value=result
-            )
-            print(f"[ROOT] Query #{self.query_count}: {query_msg.domain} -> TLD server for .{tld} at {tld_host}:{tld_port}")
-        else:
-            response = DNSMessage(
-                msg_type="RESPONSE",
-                query_id=query_msg.query_id,
-                domain=query_msg.domain,
-                result_type="ERROR",
-                result_value=f"No TLD server for .{tld}"
-            )
-            print(f"[ROOT] Query #{self.query_count}: {query_msg.domain} -> ERROR: Unknown TLD")
-
-        return response
-
-    def start(self):
-        """Start the root server and handle incoming connections."""
-        self.sock.bind((self.host, self.port))
-        self.sock.listen(5)
-        print(f"[ROOT] Server started on {self.host}:{self.port}")
-        print(f"[ROOT] Handling TLDs: {', '.join(self.tld_servers.keys())}")
-
-        while True:
-            try:
-                conn, addr = self.sock.accept()
-                data = conn.recv(1024)
-
-                if data:
-                    query = DNSMessage.deserialize(data)
-                    response = self.handle_query(query)
-                    conn.sendall(response.serialize())
-
-                conn.close()
-            except KeyboardInterrupt:
-                print(f"\n[ROOT] Shutting down... Processed {self.query_count} queries")
-                break
-            except Exception as e:
-                print(f"[ROOT] Error: {e}")
-
-        self.sock.close()
+        respond = self._handlers.get(domain[domain.rfind(b'.'):], self._unknown_tld)
+        return respond(next(self._query_counter), query_id, domain)
+
+    def describe(self):
+        """Return the startup line listing the TLDs served."""
+        return [f"Handling TLDs: {', '.join(self.tld_servers.keys())}"]
 
 
 if __name__ == "__main__":
-    server = RootServer()
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Root DNS Server')
+    parser.add_argument('--workers', type=int, default=ROOT_WORKERS,
+                        help='Number of server processes sharing the port (default: CPU count)')
+    parser.add_argument('--port', type=int, default=53000, help='Port to bind to')
+    parser.add_argument('--unix', action='store_true',
+                        help='Also serve on a Unix socket for a colocated Local Server')
+    parser.add_argument('--unix-path', type=str,
+                        help='Unix socket path (implies --unix; default derived from the port)')
+    args = parser.parse_args()
+
+    unix_path = args.unix_path or (root_unix_path(args.port) if args.unix else None)
+    server = RootServer(port=args.port, workers=args.workers, unix_path=unix_path)
     server.start()
@@ -0,0 +1,186 @@
+"""Batched UDP receive and send using Linux recvmmsg/sendmmsg.
+
+A DatagramBatcher moves up to `size` IPv4 datagrams per system call by
+calling recvmmsg(2) and sendmmsg(2) through ctypes on preallocated message
+header arrays. Where those calls are unavailable (non-Linux platforms,
+non-IPv4 sockets) it falls back to one recvfrom/sendto per datagram with
+the same interface.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import socket
+
+MSG_DONTWAIT = getattr(socket, 'MSG_DONTWAIT', 0x40)
+
+
+class _IOVec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p), ('iov_len', ctypes.c_size_t)]
+
+
+class _SockaddrIn(ctypes.Structure):
+    _fields_ = [('sin_family', ctypes.c_ushort), ('sin_port', ctypes.c_uint16),
+                ('sin_addr', ctypes.c_uint8 * 4), ('sin_zero', ctypes.c_uint8 * 8)]
+
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [('msg_name', ctypes.c_void_p), ('msg_namelen', ctypes.c_uint32),
+                ('msg_iov', ctypes.POINTER(_IOVec)), ('msg_iovlen', ctypes.c_size_t),
+                ('msg_control', ctypes.c_void_p), ('msg_controllen', ctypes.c_size_t),
+                ('msg_flags', ctypes.c_int)]
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', _MsgHdr), ('msg_len', ctypes.c_uint)]
+
+
+def _load_libc():
+    """Return libc with recvmmsg/sendmmsg prototypes, or None if unavailable."""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        recvmmsg, sendmmsg = libc.recvmmsg, libc.sendmmsg
+    except (OSError, AttributeError):
+        return None
+    recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint,
+                         ctypes.c_int, ctypes.c_void_p]
+    sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int]
+    recvmmsg.restype = sendmmsg.restype = ctypes.c_int
+    return libc
+
+
+_libc = _load_libc()
+
+
+class DatagramBatcher:
+    """Receive and send batches of datagrams on one non-blocking UDP socket.
+
+    Attributes:
+        sock: Non-blocking UDP socket.
+        size: Maximum datagrams moved per system call.
+        bufsize: Receive buffer size per datagram.
+        batched: True when recvmmsg/sendmmsg are in use.
+    """
+
+    def __init__(self, sock, size=32, bufsize=512):
+        self.sock = sock
+        self.size = size
+        self.bufsize = bufsize
+        self.batched = _libc is not None and sock.family == socket.AF_INET
+        if not self.batched:
+            return
+
+        self._recv_bufs = [ctypes.create_string_buffer(bufsize) for _ in range(size)]
+        self._recv_addrs = (_SockaddrIn * size)()
+        self._recv_iovs = (_IOVec * size)()
+        self._recv_hdrs = (_MMsgHdr * size)()
+        for i in range(size):
+            self._recv_iovs[i].iov_base = ctypes.addressof(self._recv_bufs[i])
+            self._recv_iovs[i].iov_len = bufsize
+            hdr = self._recv_hdrs[i].msg_hdr
+            hdr.msg_name = ctypes.addressof(self._recv_addrs[i])
+            hdr.msg_namelen = ctypes.sizeof(_SockaddrIn)
+            hdr.msg_iov = ctypes.pointer(self._recv_iovs[i])
+            hdr.msg_iovlen = 1
+        # Headers filled by the previous recvmmsg; only these need resetting
+        self._recv_used = 0
+
+        self._send_addrs = (_SockaddrIn * size)()
+        self._send_iovs = (_IOVec * size)()
+        self._send_hdrs = (_MMsgHdr * size)()
+        for i in range(size):
+            self._send_addrs[i].sin_family = socket.AF_INET
+            hdr = self._send_hdrs[i].msg_hdr
+            hdr.msg_name = ctypes.addressof(self._send_addrs[i])
+            hdr.msg_namelen = ctypes.sizeof(_SockaddrIn)
+            hdr.msg_iov = ctypes.pointer(self._send_iovs[i])
+            hdr.msg_iovlen = 1
+
+    def recv(self):
+        """Read the datagrams that are already queued, up to size of them.
+
+        Returns:
+            List of (payload, (host, port)) tuples; empty if nothing is
+            waiting.
+
+        Raises:
+            OSError: If the receive fails for a reason other than an empty
+                socket queue.
+        """
+        if not self.batched:
+            messages = []
+            for _ in range(self.size):
+                try:
+                    messages.append(self.sock.recvfrom(self.bufsize))
+                except BlockingIOError:
+                    break
+            return messages
+
+        # recvmmsg overwrites msg_namelen; reset it only on the slots it used
+        namelen = ctypes.sizeof(_SockaddrIn)
+        for i in range(self._recv_used):
+            self._recv_hdrs[i].msg_hdr.msg_namelen = namelen
+
+        count = _libc.recvmmsg(self.sock.fileno(), self._recv_hdrs, self.size, MSG_DONTWAIT, None)
+        if count < 0:
+            err = ctypes.get_errno()
+            self._recv_used = 0
+            if err in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return []
+            raise OSError(err, os.strerror(err))
+        self._recv_used = count
+
+        messages = []
+        for i in range(count):
+            addr = self._recv_addrs[i]
+            payload = self._recv_bufs[i].raw[:self._recv_hdrs[i].msg_len]
+            messages.append((payload, (socket.inet_ntoa(bytes(addr.sin_addr)),
+                                       socket.ntohs(addr.sin_port))))
+        return messages
+
+    def send(self, messages):
+        """Send datagrams, size of them per system call.
+
+        Datagrams the kernel refuses because the send buffer is full are
+        dropped, as a UDP sender would.
+
+        Args:
+            messages: List of (payload, (host, port)) tuples.
+
+        Raises:
+            OSError: If a send fails for a reason other than a full buffer.
+        """
+        if not self.batched:
+            for payload, addr in messages:
+                try:
+                    self.sock.sendto(payload, addr)
+                except BlockingIOError:
+                    pass
+            return
+
+        for start in range(0, len(messages), self.size):
+            chunk = messages[start:start + self.size]
+            # Keep the c_char_p objects alive until sendmmsg returns
+            payloads = []
+            for i, (payload, (host, port)) in enumerate(chunk):
+                data = ctypes.c_char_p(payload)
+                payloads.append(data)
+                self._send_iovs[i].iov_base = ctypes.cast(data, ctypes.c_void_p)
+                self._send_iovs[i].iov_len = len(payload)
+                addr = self._send_addrs[i]
+                addr.sin_port = socket.htons(port)
+                addr.sin_addr[:] = socket.inet_aton(host)
+
+            sent = 0
+            while sent < len(chunk):
+                count = _libc.sendmmsg(self.sock.fileno(), ctypes.byref(self._send_hdrs[sent]),
+                                       len(chunk) - sent, MSG_DONTWAIT)
+                if count < 0:
+                    err = ctypes.get_errno()
+                    if err == errno.EINTR:
+                        continue
+                    if err in (errno.EAGAIN, errno.EWOULDBLOCK):
+                        break
+                    raise OSError(err, os.strerror(err))
+                sent += count
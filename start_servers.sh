@@ -7,31 +7,31 @@ echo ""
 
 # Start Root Server
 echo "Starting Root Server (port 53000)..."
-python3 servers/root_server.py > logs/root.log 2>&1 &
+python3 -m servers.root_server > logs/root.log 2>&1 &
 ROOT_PID=$!
 sleep 0.5
 
 # Start .com TLD Server
 echo "Starting .com TLD Server (port 53001)..."
-python3 servers/tld_server.py --tld com --port 53001 > logs/tld_com.log 2>&1 &
+python3 -m servers.tld_server --tld com --port 53001 > logs/tld_com.log 2>&1 &
 TLD_COM_PID=$!
 sleep 0.5
 
 # Start .edu TLD Server
 echo "Starting .edu TLD Server (port 53002)..."
-python3 servers/tld_server.py --tld edu --port 53002 > logs/tld_edu.log 2>&1 &
+python3 -m servers.tld_server --tld edu --port 53002 > logs/tld_edu.log 2>&1 &
 TLD_EDU_PID=$!
 sleep 0.5
 
 # Start Authoritative Server
 echo "Starting Authoritative Server (port 53003)..."
-python3 servers/authoritative_server.py > logs/auth.log 2>&1 &
+python3 -m servers.authoritative_server > logs/auth.log 2>&1 &
 AUTH_PID=$!
 sleep 0.5
 
 # Start Local Server
 echo "Starting Local Server (port 53004)..."
-python3 servers/local_server.py > logs/local.log 2>&1 &
+python3 -m servers.local_server > logs/local.log 2>&1 &
 LOCAL_PID=$!
 sleep 0.5
 
@@ -4,7 +4,7 @@
 
 if [ ! -f .server_pids ]; then
     echo "No server PIDs found. Are the servers running?"
-    echo "You can manually find and kill processes with: ps aux | grep server.py"
+    echo "You can manually find and kill processes with: ps aux | grep servers."
     exit 1
 fi
 
@@ -1,9 +1,15 @@
 #!/usr/bin/env python3
 """Simple test to demonstrate cache effectiveness"""
 
+import array
 import time
 import sys
-from client.dns_client import DNSClient
+from client.dns_client import DNSClient, STATUS_IP
+from benchmark.benchmark import NS_PER_MS, latency_percentiles
+
+# Queries in the bulk pipelined pass: several megabytes each way, far more
+# than the socket buffers hold
+BULK_QUERIES = 200_000
 
 def load_domains_from_file():
     """Load domains from dns_records.txt"""
@@ -23,6 +29,40 @@ def load_domains_from_file():
 
     return domains
 
+def timed_pass(session, domains):
+    """Resolve each domain once and print per-query and summary latency.
+
+    Only the resolve call is inside the timed region; results are formatted
+    and printed after the loop.
+
+    Returns:
+        List of (status, value) tuples in the order of domains.
+    """
+    times = array.array('q', bytes(8 * len(domains)))
+    results = [None] * len(domains)
+    for i, domain in enumerate(domains):
+        start = time.perf_counter_ns()
+        results[i] = session.resolve(domain)
+        times[i] = time.perf_counter_ns() - start
+
+    for domain, (status, ip), ns in zip(domains, results, times):
+        if status != STATUS_IP:
+            ip = f"ERROR: {ip}"
+        print(f"  {domain:25s} -> {ip:20s} ({ns / NS_PER_MS:6.2f} ms)")
+    percentiles = latency_percentiles(times, (50, 99))
+    print(f"  median {percentiles[50] / NS_PER_MS:.3f} ms  p99 {percentiles[99] / NS_PER_MS:.3f} ms")
+    return results
+
+def stats_delta(before, after):
+    """Return the (hits, misses) the local server recorded between snapshots."""
+    return after["hits"] - before["hits"], after["misses"] - before["misses"]
+
+def check(condition, message):
+    """Print a failed expectation and exit non-zero."""
+    if not condition:
+        print(f"\nFAIL: {message}")
+        sys.exit(1)
+
 def main():
     client = DNSClient()
 
@@ -45,34 +85,61 @@ def main():
     print("Testing DNS Resolution with Caching")
     print("=" * 60)
 
-    # First pass - all cache misses
-    print("\nFirst pass (cache misses - full resolution):")
-    for domain in test_domains:
-        start = time.time()
-        ip = client.resolve(domain)
-        elapsed = (time.time() - start) * 1000
-        print(f"  {domain:25s} -> {ip:20s} ({elapsed:6.2f} ms)")
-
-    time.sleep(0.5)
-
-    # Second pass - all cache hits
-    print("\nSecond pass (cache hits - instant):")
-    for domain in test_domains:
-        start = time.time()
-        ip = client.resolve(domain)
-        elapsed = (time.time() - start) * 1000
-        print(f"  {domain:25s} -> {ip:20s} ({elapsed:6.2f} ms)")
-
-    time.sleep(0.5)
-
-    # Mixed workload
-    print("\nMixed workload (repeat queries):")
-    test_sequence = test_domains * 3  # Query each domain 3 more times
-    for domain in test_sequence:
-        client.resolve(domain)
-
-    print(f"\nTotal queries sent: {client.query_id}")
-    print("\nCheck local server output for cache statistics!")
+    # One pinned connection for the whole run, so timings reflect the cache
+    # rather than connection setup
+    with client.session() as session:
+        # Responses on a connection arrive in order, so each stats snapshot
+        # already reflects every query sent before it; no sleeps are needed
+        initial = session.stats()
+        check(initial is not None, "local server did not answer the stats query")
+
+        # First pass - cache misses (hits if a previous run warmed the cache)
+        print("\nFirst pass (cache misses - full resolution):")
+        first = timed_pass(session, test_domains)
+        after_first = session.stats()
+        hits, misses = stats_delta(initial, after_first)
+        print(f"  cache: {hits} hits, {misses} misses")
+        check(hits + misses == len(test_domains),
+              f"expected {len(test_domains)} cache lookups, got {hits + misses}")
+
+        # Second pass - every domain resolved in the first pass is a hit
+        print("\nSecond pass (cache hits - instant):")
+        timed_pass(session, test_domains)
+        after_second = session.stats()
+        hits, misses = stats_delta(after_first, after_second)
+        print(f"  cache: {hits} hits, {misses} misses")
+        resolved = sum(1 for status, _ in first if status == STATUS_IP)
+        check(hits == resolved, f"expected {resolved} cache hits, got {hits}")
+
+        # Mixed workload, pipelined on the same connection
+        print("\nMixed workload (repeat queries):")
+        test_sequence = test_domains * 3  # Query each domain 3 more times
+        session.resolve_many(test_sequence)
+
+        # Bulk workload - only completes if resolve_many reads responses
+        # while it is still sending queries
+        print(f"\nBulk pipelined workload ({BULK_QUERIES} queries):")
+        # Cached domains keep the pass fast; failed ones are re-resolved
+        # upstream every time
+        pool = [d for d, (status, _) in zip(test_domains, first) if status == STATUS_IP] or test_domains
+        bulk = (pool * (BULK_QUERIES // len(pool) + 1))[:BULK_QUERIES]
+        start = time.perf_counter_ns()
+        bulk_results = session.resolve_many(bulk)
+        elapsed = time.perf_counter_ns() - start
+        print(f"  {len(bulk_results)} answers in {elapsed / NS_PER_MS:.0f} ms")
+        expected = {domain: status for domain, (status, _) in zip(test_domains, first)}
+        wrong = sum(1 for domain, (status, _) in zip(bulk, bulk_results)
+                    if status != expected[domain])
+        check(wrong == 0, f"{wrong} bulk answers differ from the first pass")
+        final = session.stats()
+
+    # client.query_id also counts the __stats__ queries, which the server
+    # leaves out of its own query count
+    sent = 2 * len(test_domains) + len(test_sequence) + len(bulk)
+    print(f"\nTotal queries sent: {sent}")
+    hits, misses = stats_delta(initial, final)
+    print(f"Local server: {final['queries'] - initial['queries']} queries, {hits} hits, "
+          f"{misses} misses, {final['cache_size']} cached")
 
 if __name__ == "__main__":
     main()